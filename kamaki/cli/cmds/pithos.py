@@ -38,6 +38,7 @@ from os import path, walk, makedirs
 from threading import activeCount, enumerate as activethreads
 
 from kamaki.clients.pithos import PithosClient, ClientError
+from kamaki.clients.pithos.cache import HashCache, BlockStore, UploadJournal
 from kamaki.clients.utils import escape_ctrl_chars
 
 from kamaki.cli import command
@@ -95,6 +96,15 @@ class _PithosInit(CommandInit):
         self.client.account = self.account
         self.container = self._custom_container() or 'pithos'
         self.client.container = self.container
+        hash_cache = self.config.get('global', 'hash_cache')
+        if hash_cache:
+            self.client.hash_cache = HashCache(hash_cache)
+        upload_journal = self.config.get('global', 'upload_journal')
+        if upload_journal:
+            self.client.upload_journal = UploadJournal(upload_journal)
+        block_store = self.config.get('global', 'block_store')
+        if block_store:
+            self.client.block_store = BlockStore(block_store)
 
     def main(self):
         self._run()
@@ -920,10 +930,15 @@ class file_upload(_PithosContainer):
     """Upload a file
 
     The default destination is /pithos/NAME
-    where NAME is the base name of the source path"""
+    where NAME is the base name of the source path
+    Use - as the source path to upload from the standard input (e.g., a pipe)
+    """
 
     arguments = dict(
         max_threads=IntArgument('default: 5', '--threads'),
+        hash_threads=IntArgument(
+            'Threads for calculating block hashes (default: number of CPUs)',
+            '--hash-threads'),
         content_encoding=ValueArgument(
             'set MIME content type', '--content-encoding'),
         content_disposition=ValueArgument(
@@ -952,6 +967,18 @@ class file_upload(_PithosContainer):
             'Confirm upload with a custom checksum (MD5)', '--etag'),
         use_hashes=FlagArgument(
             'Source file contains hashmap not data', '--source-is-hashmap'),
+        pipelined=FlagArgument(
+            'Upload blocks while hashing (faster for new files, but blocks '
+            'already on the server are uploaded again)', '--pipelined'),
+        file_threads=IntArgument(
+            'Files to upload at the same time, when uploading directories '
+            '(default: 1)',
+            '--file-threads'),
+        resume=FlagArgument(
+            'Resume interrupted uploads: blocks already uploaded are not '
+            'hashed or uploaded again (implies -f, requires the '
+            'upload_journal setting)',
+            '--resume'),
     )
 
     def _sharing(self):
@@ -999,7 +1026,7 @@ class file_upload(_PithosContainer):
                     'Use %s to upload directories & contents' % (
                         self.arguments['recursive'].lvalue)])
             robj = self.client.container_get(path=rpath)
-            if not self['overwrite']:
+            if not (self['overwrite'] or self['resume']):
                 if robj.json:
                     raise CLIError(
                         'Objects/files prefixed as %s already exist' % rpath,
@@ -1038,7 +1065,7 @@ class file_upload(_PithosContainer):
                     if path.isfile(fpath):
                         rel_path = rel_path.replace(path.sep, '/')
                         pathfix = f.replace(path.sep, '/')
-                        yield open(fpath, 'rb'), '%s/%s' % (rel_path, pathfix)
+                        yield fpath, '%s/%s' % (rel_path, pathfix)
                     else:
                         self.error('%s not a regular file' % fpath)
         else:
@@ -1050,7 +1077,7 @@ class file_upload(_PithosContainer):
                 if remote_path and self.object_is_dir(robj):
                     rpath += '/%s' % (short_path.replace(path.sep, '/'))
                     self.client.get_object_info(rpath)
-                if not self['overwrite']:
+                if not (self['overwrite'] or self['resume']):
                     raise CLIError(
                         'Object /%s/%s already exists' % (
                             self.container, rpath),
@@ -1061,19 +1088,92 @@ class file_upload(_PithosContainer):
                 else:
                     raise
             self._check_container_limit(lpath)
-            yield open(lpath, 'rb'), rpath
+            yield lpath, rpath
+
+    def _upload_files(self, sources, params):
+        """Upload many files at the same time, with one progress bar"""
+        rpref = ('pithos://%s' % self['account']) if self['account'] else ''
+        sources = [(lpath, rpath, dict()) for lpath, rpath in sources]
+        if not (self['content_type'] and self['content_encoding']):
+            for lpath, rpath, file_params in sources:
+                ctype, cenc = guess_mime_type(lpath)
+                file_params['content_type'] = self['content_type'] or ctype
+                file_params['content_encoding'] = (
+                    self['content_encoding'] or cenc)
+        caller_id = self.astakos.user_term('id')
+        if self.client.account != caller_id:
+            params['target_account'], self.client.account = (
+                self.client.account, caller_id)
+        (progress_bar, upload_cb) = self._safe_progress_bar(
+            'Uploading %s files' % len(sources))
+        try:
+            for lpath, rpath, headers in self.client.upload_objects(
+                    sources,
+                    upload_cb=upload_cb,
+                    max_files=self['file_threads'],
+                    pipelined=self['pipelined'],
+                    resume=self['resume'],
+                    **params):
+                self.error('%s --> %s/%s/%s' % (
+                    lpath, rpref, self.client.container, rpath))
+                if self['public']:
+                    obj = self.client.get_object_info(rpath)
+                    self.write('%s\n' % obj.get('x-object-public', ''))
+        except KeyboardInterrupt:
+            self.client.shutdown_workers(wait=False)
+            raise CLIError('Upload canceled by user')
+        finally:
+            self._safe_progress_bar_finish(progress_bar)
+        self.error('Upload completed')
+
+    def _upload_stream(self, rpath, params):
+        """Upload the standard input, without staging it to a file"""
+        try:
+            self.client.get_object_info(rpath)
+            if not self['overwrite']:
+                raise CLIError(
+                    'Object /%s/%s already exists' % (self.container, rpath),
+                    details=['use -f to overwrite'])
+        except ClientError as ce:
+            if ce.status in (404, ):
+                self._container_exists()
+            else:
+                raise
+        self.error('<stdin> --> %s/%s' % (self.client.container, rpath))
+        caller_id = self.astakos.user_term('id')
+        if self.client.account != caller_id:
+            params['target_account'], self.client.account = (
+                self.client.account, caller_id)
+        try:
+            headers = self.client.upload_from_stream(
+                rpath, self._in, etag=self['md5_checksum'], **params)
+        except KeyboardInterrupt:
+            self.client.shutdown_workers(wait=False)
+            raise CLIError('Upload canceled by user')
+        if self['public']:
+            self.write('%s\n' % headers.get('x-object-public', ''))
+        self.error('Upload completed')
 
     def _run(self, local_path, remote_path):
         self.client.MAX_THREADS = int(self['max_threads'] or 5)
+        if self['hash_threads'] > 0:
+            self.client.HASH_THREADS = int(self['hash_threads'])
         params = dict(
             content_encoding=self['content_encoding'],
             content_type=self['content_type'],
             content_disposition=self['content_disposition'],
             sharing=self._sharing(),
             public=self['public'])
-        container_info_cache = dict()
+        if local_path == '-':
+            return self._upload_stream(remote_path, params)
+        if self['file_threads'] > 1 and not (
+                self['unchunked'] or self['use_hashes']):
+            return self._upload_files(
+                self._src_dst(local_path, remote_path), params)
+        container_info_cache, confirmed = dict(), set()
         rpref = ('pithos://%s' % self['account']) if self['account'] else ''
-        for f, rpath in self._src_dst(local_path, remote_path):
+        for lpath, rpath in self._src_dst(local_path, remote_path):
+            f = open(lpath, 'rb')
             self.error('%s --> %s/%s/%s' % (
                 f.name, rpref, self.client.container, rpath))
             if not (self['content_type'] and self['content_encoding']):
@@ -1105,8 +1205,12 @@ class file_upload(_PithosContainer):
                         hash_cb=hash_cb,
                         upload_cb=upload_cb,
                         container_info_cache=container_info_cache,
+                        pipelined=self['pipelined'],
+                        confirmed=confirmed,
+                        resume=self['resume'],
                         **params)
                 except KeyboardInterrupt:
+                    self.client.shutdown_workers(wait=False)
                     timeout = 0.5
                     msg = '\n'
                     while activeCount() > 1:
@@ -1138,6 +1242,21 @@ class file_upload(_PithosContainer):
 
     def main(self, local_path, remote_path_or_url=None):
         super(self.__class__, self)._run(remote_path_or_url)
+        if self['resume'] and self.client.upload_journal is None:
+            raise CLIInvalidArgument(
+                'Uploads cannot be resumed', importance=2, details=[
+                    '%s requires an upload journal, e.g.,' % (
+                        self.arguments['resume'].lvalue),
+                    '  kamaki config set upload_journal ~/.kamaki.uploads'])
+        if local_path == '-':
+            if not self.path:
+                raise CLIInvalidArgument(
+                    'Missing remote path', importance=2, details=[
+                        'A remote path is required to upload from the '
+                        'standard input, e.g.,',
+                        '  tar c DIR | kamaki file upload - /%s/DIR.tar' % (
+                            self.container)])
+            return self._run(local_path=local_path, remote_path=self.path)
         if local_path.endswith('.') or local_path.endswith(path.sep):
             remote_path = self.path or ''
         else:
@@ -1239,6 +1358,10 @@ class file_download(_PithosContainer):
         resume=FlagArgument(
             'Resume/Overwrite (attempt resume, else overwrite)',
             ('-f', '--resume')),
+        delta=FlagArgument(
+            'Update existing local files, reusing any blocks they contain '
+            '(implies --resume)',
+            '--delta'),
         range=RangeArgument(
             'Download only that range of data e.g., 5,10-20,-5', '--range'),
         matching_etag=ValueArgument('download iff ETag match', '--if-match'),
@@ -1253,19 +1376,27 @@ class file_download(_PithosContainer):
         object_version=ValueArgument(
             'download a file of a specific version', '--object-version'),
         max_threads=IntArgument('default: 5', '--threads'),
+        range_blocks=IntArgument(
+            'Max number of adjacent blocks to get with one request '
+            '(default: 1)', '--range-blocks'),
         progress_bar=ProgressBarArgument(
             'do not show progress bar', ('-N', '--no-progress-bar'),
             default=False),
         recursive=FlagArgument(
             'Download a remote directory object and its contents',
-            ('-r', '--recursive'))
+            ('-r', '--recursive')),
+        file_threads=IntArgument(
+            'Files to download at the same time, when downloading '
+            'directories (default: 1)',
+            '--file-threads'),
         )
 
-    def _src_dst(self, local_path):
-        """Create a list of (src, dst) where src is a remote location and dst
-        is an open file descriptor. Directories are denoted as (None, dirpath)
-        and they are pretended to other objects in a very strict order (shorter
-        to longer path)."""
+    def _targets(self, local_path):
+        """Create a list of (src, dst, resume, size) where src is a remote
+        location, dst is a local path and size is the size of the remote
+        object, if known. Directories are denoted as (None, dirpath, None,
+        None) and they are pretended to other objects in a very strict order
+        (shorter to longer path)."""
         ret, obj = [], None
         # The prefix is actually the relative remote path without
         # the trailing separator.
@@ -1322,7 +1453,7 @@ class file_download(_PithosContainer):
                     if self.object_is_dir(o):
                         dirs.append((remote, final))
                     else:
-                        files.append((remote, final))
+                        files.append((remote, final, o.get('bytes')))
                     self.error(r"%s -> %s" % (remote, final))
 
                 #  Put the directories on top of the list
@@ -1336,10 +1467,10 @@ class file_download(_PithosContainer):
                             details=[
                                 'Either remove the file or specify a'
                                 'different target location'])
-                    ret.append((None, dpath, None))
+                    ret.append((None, dpath, None, None))
 
                 #  Append the file objects
-                for opath, lpath in files:
+                for opath, lpath, size in files:
                     if self['resume']:
                         fxists = path.exists(lpath)
                         if fxists and path.isdir(lpath):
@@ -1349,14 +1480,14 @@ class file_download(_PithosContainer):
                                 details=[
                                     'Either remove the file or specify a'
                                     'different target location'])
-                        ret.append((opath, lpath, fxists))
+                        ret.append((opath, lpath, fxists, size))
                     elif path.exists(lpath):
                         raise CLIError(
                             'Cannot overwrite %s' % lpath,
                             details=['To overwrite/resume, use  %s' % (
                                 self.arguments['resume'].lvalue)])
                     else:
-                        ret.append((opath, lpath, None))
+                        ret.append((opath, lpath, None, size))
             elif prefix:
                 raise CLIError(
                     'Remote object /%s/%s is a directory' % (
@@ -1385,10 +1516,19 @@ class file_download(_PithosContainer):
                 # Delegate intermediate local dir cration
                 # to makedirs() inside _run()
                 d = path.dirname(local_path)
-                ret.append((None, d, None))
-            ret.append((prefix, local_path, self['resume']))
+                ret.append((None, d, None, None))
+            size = obj.get('content-length')
+            ret.append((
+                prefix, local_path, self['resume'],
+                None if size is None else int(size)))
+        return ret
 
-        for r, l, resume in ret:
+    def _src_dst(self, local_path):
+        """Create a list of (src, dst) where src is a remote location and dst
+        is an open file descriptor. Directories are denoted as (None, dirpath)
+        and they are pretended to other objects in a very strict order (shorter
+        to longer path)."""
+        for r, l, resume, size in self._targets(local_path):
             if r:
                 mode = 'rb+' if resume and path.exists(l) else 'wb+'
                 with open(l, mode) as f:
@@ -1396,6 +1536,38 @@ class file_download(_PithosContainer):
             else:
                 yield (r, l)
 
+    def _download_files(self, local_path):
+        """Download many files at the same time, with one progress bar"""
+        targets = []
+        for rpath, lpath, resume, size in self._targets(local_path):
+            if rpath:
+                targets.append((rpath, lpath, size))
+            elif not path.exists(lpath):
+                self.error('Create local directory %s' % lpath)
+                makedirs(lpath)
+        progress_bar, download_cb = self._safe_progress_bar(
+            'Downloading %s files' % len(targets))
+        try:
+            for rpath, lpath in self.client.download_objects(
+                    targets,
+                    download_cb=download_cb,
+                    max_files=self['file_threads'],
+                    range_str=self['range'],
+                    version=self['object_version'],
+                    if_match=self['matching_etag'],
+                    resume=self['resume'],
+                    if_none_match=self['non_matching_etag'],
+                    if_modified_since=self['modified_since_date'],
+                    if_unmodified_since=self['unmodified_since_date'],
+                    delta=self['delta']):
+                self.error('/%s/%s --> %s' % (self.container, rpath, lpath))
+        except KeyboardInterrupt:
+            self.client.shutdown_workers(wait=False)
+            raise CLIError('Download canceled by user')
+        finally:
+            self._safe_progress_bar_finish(progress_bar)
+        self.error('Download completed')
+
     @errors.Generic.all
     @errors.Pithos.connection
     @errors.Pithos.container
@@ -1404,6 +1576,10 @@ class file_download(_PithosContainer):
     @errors.Pithos.local_path_download
     def _run(self, local_path):
         self.client.MAX_THREADS = int(self['max_threads'] or 5)
+        if self['range_blocks'] > 0:
+            self.client.MAX_RANGE_BLOCKS = self['range_blocks']
+        if self['file_threads'] > 1:
+            return self._download_files(local_path)
         progress_bar = None
         try:
             # From _src_dst():
@@ -1430,8 +1606,10 @@ class file_download(_PithosContainer):
                     resume=self['resume'],
                     if_none_match=self['non_matching_etag'],
                     if_modified_since=self['modified_since_date'],
-                    if_unmodified_since=self['unmodified_since_date'])
+                    if_unmodified_since=self['unmodified_since_date'],
+                    delta=self['delta'])
         except KeyboardInterrupt:
+            self.client.shutdown_workers(wait=False)
             timeout = 0.5
             msg = '\n'
             while activeCount() > 1:
@@ -1455,6 +1633,8 @@ class file_download(_PithosContainer):
     def main(self, remote_path_or_url, local_path=None):
         """ Dowload remote_path_or_url to local_path. """
         super(self.__class__, self)._run(remote_path_or_url)
+        if self['delta']:
+            self.arguments['resume'].value = True
         # Translate relative remote path to local path with proper separator
         # and without trailing '/'. If not given use the name of the container
         rpath = self.path.rstrip('/').replace('/', path.sep) or self.container
@@ -87,6 +87,14 @@ DOCUMENTATION['global']['colors'] = (
 DOCUMENTATION['global']['history_file'] = 'path to store kamaki history',
 DOCUMENTATION['global']['history_limit'] = '#commands to keep in history',
 DOCUMENTATION['global']['log_file'] = 'path to dumb kamaki logs',
+DOCUMENTATION['global']['hash_cache'] = (
+    'directory to cache local file block hashes, e.g., ~/.kamaki.hashes '
+    '(not set or empty to disable)'),
+DOCUMENTATION['global']['upload_journal'] = (
+    'directory to journal uploads, so that they can be resumed, e.g., '
+    '~/.kamaki.uploads (not set or empty to disable)'),
+DOCUMENTATION['global']['block_store'] = (
+    'directory to keep downloaded blocks for reuse (empty to disable)'),
 DOCUMENTATION['global']['log_token'] = (
     'show user token in HTTP logs (insecure - on / off)'),
 DOCUMENTATION['global']['log_data'] = (
@@ -32,12 +32,15 @@
 
 from urllib2 import quote, unquote
 from urlparse import urlparse
-from threading import Thread
+from threading import Thread, Event, Lock, current_thread
+from Queue import Queue, Empty
 from json import dumps, loads
 from time import time
 from httplib import ResponseNotReady, HTTPException
 from time import sleep
 from random import random
+from weakref import WeakSet
+import atexit
 import logging
 import ssl
 import re
@@ -164,9 +167,13 @@ class RequestManager(Logged):
             sendlog.log(DEBUGV, '  %s: %s%s' % (key, val, plog))
         if self.data:
             sendlog.log(DEBUGV, 'data size: %s%s' % (len(self.data), plog))
-            if self.LOG_DATA:
-                sendlog.log(DEBUGV, utils.escape_ctrl_chars(self.data.replace(
-                    self._token, '...') if self._token else self.data))
+            if self.LOG_DATA and isinstance(self.data, utils.FileSlice):
+                sendlog.log(DEBUGV, '<streamed from file>%s' % plog)
+            elif self.LOG_DATA:
+                data = self.data if isinstance(
+                    self.data, basestring) else memoryview(self.data).tobytes()
+                sendlog.log(DEBUGV, utils.escape_ctrl_chars(data.replace(
+                    self._token, '...') if self._token else data))
         else:
             sendlog.log(DEBUGV, 'data size: 0%s' % plog)
 
@@ -190,6 +197,7 @@ class RequestManager(Logged):
         self._encode_headers()
         self.dump_log()
         try:
+            #  A FileSlice body is read and sent by httplib, chunk by chunk
             conn.request(
                 method=self.method.upper(),
                 url=self.path.encode('utf-8'),
@@ -231,7 +239,15 @@ class RequestManager(Logged):
 
 
 class ResponseManager(Logged):
-    """Manage the http request and handle the response data, headers, etc."""
+    """Manage the http request and handle the response data, headers, etc.
+
+    In streaming mode, the response body is not read along with the status
+    and headers. It is read through read, iter_content or readinto, and the
+    connection returns to the pool when the body is exhausted or on close.
+    """
+
+    STREAM_CHUNK_SIZE = 64 * 1024
+    stream = False
 
     def __init__(self, request, poolsize=None, connection_retry_limit=0):
         """
@@ -246,6 +262,7 @@ class ResponseManager(Logged):
         self._request_performed = False
         self.poolsize = poolsize
         self._headers_to_decode, self._header_prefices = [], []
+        self._body, self._connection, self._streamed = None, None, 0
 
     def _get_headers_to_decode(self, headers):
         keys = set([k.lower() for k, v in headers])
@@ -258,6 +275,17 @@ class ResponseManager(Logged):
             return False
         return encodable + filter(has_prefix, keys.difference(encodable))
 
+    def _log_content(self):
+        plog = ('\t[%s]' % self) if self.LOG_PID else ''
+        recvlog.log(DEBUGV, 'data size: %s%s' % (
+            len(self._content) if self._content else 0, plog))
+        if self.LOG_DATA and self._content:
+            data = '%s%s' % (self._content, plog)
+            data = utils.escape_ctrl_chars(data)
+            if self._token:
+                data = data.replace(self._token, '...')
+            recvlog.log(DEBUGV, data)
+
     def _get_response(self):
         if self._request_performed:
             return
@@ -265,9 +293,10 @@ class ResponseManager(Logged):
         pool_kw = dict(size=self.poolsize) if self.poolsize else dict()
         for retries in range(1, self.CONNECTION_TRY_LIMIT + 1):
             try:
-                with https.PooledHTTPConnection(
-                        self.request.netloc, self.request.scheme,
-                        **pool_kw) as connection:
+                pooled = https.PooledHTTPConnection(
+                    self.request.netloc, self.request.scheme, **pool_kw)
+                connection, clean = pooled.acquire(), False
+                try:
                     self.request.LOG_TOKEN = self.LOG_TOKEN
                     self.request.LOG_DATA = self.LOG_DATA
                     self.request.LOG_PID = self.LOG_PID
@@ -291,15 +320,20 @@ class ResponseManager(Logged):
                         self._headers[k] = unquote(v).decode('utf-8') if (
                             k.lower()) in enc_headers else v
                         recvlog.log(DEBUGV, '  %s: %s%s' % (k, v, plog))
-                    self._content = r.read()
-                    recvlog.log(DEBUGV, 'data size: %s%s' % (
-                        len(self._content) if self._content else 0, plog))
-                    if self.LOG_DATA and self._content:
-                        data = '%s%s' % (self._content, plog)
-                        data = utils.escape_ctrl_chars(data)
-                        if self._token:
-                            data = data.replace(self._token, '...')
-                        recvlog.log(DEBUGV, data)
+                    if self.stream:
+                        self._body, self._connection = r, pooled
+                        pooled = None
+                    else:
+                        self._content = r.read()
+                        clean = True
+                        self._log_content()
+                finally:
+                    if pooled is not None:
+                        if not clean:
+                            #  Never put a connection with a pending request
+                            #  or unread response data back to the pool
+                            pooled.obj.close()
+                        pooled.release()
                 break
             except Exception as err:
                 if isinstance(err, HTTPException):
@@ -313,6 +347,77 @@ class ResponseManager(Logged):
                         DEBUGV, '\n'.join(['%s' % type(err)] + format_stack()))
                     raise
 
+    def read(self, amt=None):
+        """Read the (rest of the) response body, or up to amt bytes of it,
+        in streaming mode
+
+        :param amt: (int) the maximum number of bytes to read
+
+        :returns: (str) an empty string, when the body is exhausted
+        """
+        self._get_response()
+        if self._body is None:
+            return ''
+        try:
+            data = self._body.read() if amt is None else self._body.read(amt)
+        except Exception:
+            self.close()
+            raise
+        self._streamed += len(data)
+        if amt is None or not data:
+            self.close()
+        return data
+
+    def iter_content(self, chunk_size=None):
+        """Iterate over the response body, in streaming mode
+
+        :param chunk_size: (int) the maximum size of each chunk, by default
+            STREAM_CHUNK_SIZE
+
+        :returns: (generator) of str chunks
+        """
+        chunk_size = chunk_size or self.STREAM_CHUNK_SIZE
+        chunk = self.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(chunk_size)
+
+    def readinto(self, buffer_):
+        """Read the response body into a buffer, in streaming mode, one chunk
+        at a time, so that the body is never held in memory as a whole
+
+        :param buffer_: (bytearray or writable memoryview) the destination
+
+        :returns: (int) the number of bytes read, less than the size of the
+            buffer only if the body is exhausted
+        """
+        view, size = memoryview(buffer_), 0
+        while size < len(view):
+            chunk = self.read(min(len(view) - size, self.STREAM_CHUNK_SIZE))
+            if not chunk:
+                break
+            view[size:size + len(chunk)] = chunk
+            size += len(chunk)
+        return size
+
+    def close(self):
+        """Give the connection of a streamed response back to the pool. If
+        the body is not exhausted, the connection is closed first, so that it
+        is not reused with unread data on the wire
+        """
+        body, pooled = self._body, self._connection
+        if pooled is None:
+            return
+        self._body, self._connection = None, None
+        try:
+            if not body.isclosed():
+                pooled.obj.close()
+        finally:
+            pooled.release()
+            plog = ('\t[%s]' % self) if self.LOG_PID else ''
+            recvlog.log(DEBUGV, 'data size: %s (streamed)%s' % (
+                self._streamed, plog))
+
     @property
     def status_code(self):
         self._get_response()
@@ -331,6 +436,9 @@ class ResponseManager(Logged):
     @property
     def content(self):
         self._get_response()
+        if self._body is not None:
+            self._content = self.read()
+            self._log_content()
         return self._content
 
     @property
@@ -338,8 +446,7 @@ class ResponseManager(Logged):
         """
         :returns: (str) content
         """
-        self._get_response()
-        return '%s' % self._content
+        return '%s' % self.content
 
     @property
     def headers_to_decode(self):
@@ -364,9 +471,8 @@ class ResponseManager(Logged):
         """
         :returns: (dict) squeezed from json-formated content
         """
-        self._get_response()
         try:
-            return loads(self._content)
+            return loads(self.content)
         except ValueError as err:
             raise ClientError('Response not formated in JSON - %s' % err)
 
@@ -395,6 +501,296 @@ class SilentEvent(Thread):
             self._exception = e
 
 
+class Future(object):
+    """The pending result of a method(*args, **kwargs) call, which is run by a
+    WorkerPool. Provides the same interface as SilentEvent (isAlive, join,
+    value, exception), so that they can be used interchangeably.
+    """
+
+    size = 0
+    started, finished = None, None
+
+    def __init__(self, method, *args, **kwargs):
+        self.method, self.args, self.kwargs = method, args, kwargs
+        self._done = Event()
+        self._lock = Lock()
+        self._callbacks = []
+
+    @property
+    def exception(self):
+        return getattr(self, '_exception', False)
+
+    @property
+    def value(self):
+        return getattr(self, '_value', None)
+
+    @property
+    def elapsed(self):
+        """:returns: (float) seconds spent running the method"""
+        if self.started is None:
+            return 0.0
+        return (self.finished or time()) - self.started
+
+    def run(self):
+        with self._lock:
+            if self._done.isSet():
+                return
+            self.started = time()
+        try:
+            self._value = self.method(*(self.args), **(self.kwargs))
+        except Exception as e:
+            estatus = e.status if isinstance(e, ClientError) else ''
+            recvlog.debug('Future %s got exception %s\n<%s %s' % (
+                self, type(e), estatus, e))
+            self._exception = e
+        self.finished = time()
+        self._finish()
+
+    def cancel(self):
+        """Finish a pending future without running its method"""
+        with self._lock:
+            if self.started is not None or self._done.isSet():
+                return
+            self._exception = ClientError('Operation canceled')
+        self._finish()
+
+    def _finish(self):
+        with self._lock:
+            self._done.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback(self)
+
+    def add_done_callback(self, callback):
+        """Call callback(self) when finished, or now if already finished"""
+        with self._lock:
+            if not self._done.is_set():
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def done(self):
+        return self._done.is_set()
+
+    def isAlive(self):
+        return not self._done.is_set()
+
+    is_alive = isAlive
+
+    def join(self, timeout=None):
+        """Block until finished (or timeout). Unlike Thread.join, waiting
+        without a timeout can still be interrupted by the user"""
+        if timeout is not None:
+            return self._done.wait(timeout)
+        while not self._done.wait(1.0):
+            pass
+
+    def result(self, timeout=None):
+        """Block until finished and return the value or raise the exception
+        """
+        self.join(timeout)
+        if self.exception:
+            raise self.exception
+        return self.value
+
+
+_live_worker_pools = WeakSet()
+
+
+@atexit.register
+def _shutdown_worker_pools():
+    """Stop idle workers at exit, before the interpreter tears down the
+    modules they use while they wait for jobs"""
+    pools = list(_live_worker_pools)
+    for pool in pools:
+        pool.shutdown(wait=False)
+    for pool in pools:
+        for worker in list(pool._workers):
+            worker.join(0.1)
+
+
+class WorkerPool(object):
+    """A bounded set of worker threads. Workers are started on demand, up to
+    size, and they are reused by all submitted method calls. A worker which
+    stays idle for IDLE_TIMEOUT seconds retires, so that idle pools (e.g., of
+    clients that are not used any more) do not keep threads alive.
+    """
+
+    IDLE_TIMEOUT = 5.0
+
+    def __init__(self, size=1):
+        self._queue = Queue()
+        self._workers = []
+        self._lock = Lock()
+        self.closed = False
+        self.resize(size)
+        _live_worker_pools.add(self)
+
+    def resize(self, size):
+        """Change the maximum number of workers. Excess workers retire as soon
+        as they finish their current job"""
+        assert isinstance(size, int) and size > 0, 'Pool size not a +int'
+        self.size = size
+
+    def _work(self):
+        while True:
+            try:
+                future = self._queue.get(timeout=self.IDLE_TIMEOUT)
+            except Empty:
+                #  Jobs are queued under the lock, so a worker never retires
+                #  while a job is left without a worker to run it
+                with self._lock:
+                    if self._queue.empty():
+                        self._workers.remove(current_thread())
+                        return
+                continue
+            if future is None:
+                break
+            future.run()
+            with self._lock:
+                if len(self._workers) > self.size:
+                    self._workers.remove(current_thread())
+                    return
+        with self._lock:
+            self._workers.remove(current_thread())
+
+    def put(self, future):
+        """Schedule a (not yet run) Future to be run by a worker
+
+        :returns: (Future) the same future
+        """
+        assert not self.closed, 'Worker pool is shut down'
+        with self._lock:
+            if len(self._workers) < self.size:
+                worker = Thread(target=self._work)
+                worker.daemon = True
+                self._workers.append(worker)
+                worker.start()
+            self._queue.put(future)
+        return future
+
+    def submit(self, method, *args, **kwargs):
+        """Run method(*args, **kwargs) in a worker
+
+        :returns: (Future)
+        """
+        return self.put(Future(method, *args, **kwargs))
+
+    def shutdown(self, wait=True):
+        """Cancel pending jobs and stop the workers when they are done with
+        their current jobs
+
+        :param wait: (bool) block until all workers are stopped
+        """
+        self.closed = True
+        with self._lock:
+            workers = list(self._workers)
+        while not self._queue.empty():
+            future = self._queue.get()
+            if future is not None:
+                future.cancel()
+        for worker in workers:
+            self._queue.put(None)
+        if wait:
+            for worker in workers:
+                while worker.is_alive():
+                    worker.join(1.0)
+
+
+class ConcurrencyPolicy(object):
+    """Decide how many operations a Client keeps in flight. This one keeps
+    the limit fixed to the maximum (Client.MAX_THREADS). Subclasses adapt the
+    limit to the feedback of each finished operation.
+    """
+
+    def __init__(self):
+        self.limit = self.max_limit = 1
+
+    def reset(self, max_limit):
+        """Called before each batch of operations"""
+        self.limit = self.max_limit = max_limit
+
+    def update(self, future):
+        """Called after each finished operation
+
+        :param future: (Future) the finished operation. Its size (bytes
+            transfered) and elapsed time are used as feedback.
+        """
+
+
+class AIMDConcurrency(ConcurrencyPolicy):
+    """Additive Increase / Multiplicative Decrease of the concurrency limit
+
+    Throughput (bytes/sec) is measured over rounds of "limit" operations. As
+    long as it does not drop, the limit is increased: doubled on slow start,
+    then by one. If it drops, the limit is decreased by one, or it is cut by
+    decrease_factor if latency also grows (requests are queued, not served).
+    A server that responds with a status in backoff_statuses (overloaded or
+    throttling) cuts the limit, too.
+
+    The learned limit is kept between batches.
+    """
+
+    decrease_factor = 0.5
+    tolerance = 0.1
+    latency_factor = 2.0
+    backoff_statuses = (429, 500, 502, 503, 504)
+
+    def __init__(self):
+        super(AIMDConcurrency, self).__init__()
+        self.slow_start = True
+        self._throughput, self._min_latency = None, None
+        self._last_decrease = 0.0
+        self._new_round()
+
+    def _new_round(self):
+        self._round_start, self._round_bytes = time(), 0
+        self._round_latency, self._round_size = 0.0, 0
+
+    def _decrease(self, factor=None):
+        self.slow_start = False
+        self.limit = max(1, int(self.limit * factor) if (
+            factor) else self.limit - 1)
+        self._throughput, self._last_decrease = None, time()
+        log.debug('Decrease concurrency limit to %s' % self.limit)
+
+    def reset(self, max_limit):
+        self.max_limit = max_limit
+        self.limit = max(1, min(self.limit, max_limit))
+        self._new_round()
+
+    def update(self, future):
+        err = future.exception
+        if err:
+            if isinstance(err, ClientError) and (
+                    err.status in self.backoff_statuses) and (
+                    (future.started or 0) >= self._last_decrease):
+                self._decrease(self.decrease_factor)
+                self._new_round()
+            return
+        self._round_bytes += future.size
+        self._round_latency += future.elapsed
+        self._round_size += 1
+        if self._round_size < self.limit:
+            return
+
+        throughput = self._round_bytes / max(
+            time() - self._round_start, 1e-6)
+        latency = self._round_latency / self._round_size
+        if self._min_latency is None or latency < self._min_latency:
+            self._min_latency = latency
+        previous, self._throughput = self._throughput, throughput
+        if previous is None or throughput >= previous * (1 - self.tolerance):
+            if self.limit < self.max_limit:
+                self.limit = min(self.max_limit, (
+                    2 * self.limit) if self.slow_start else self.limit + 1)
+        elif latency > self.latency_factor * self._min_latency:
+            self._decrease(self.decrease_factor)
+        else:
+            self._decrease()
+        self._new_round()
+
+
 def strip_version(url):
     """Given a synnefo endpoint it will return the URL without the API version
     part as well as the API version of the URL.
@@ -408,9 +804,14 @@ def strip_version(url):
     return (url[:len(url)-len(ver)], ver)
 
 
+_worker_pool_lock = Lock()
+
+
 class Client(Logged):
     service_type = ''
     MAX_THREADS = 1
+    CONCURRENCY_POLICY = AIMDConcurrency
+    concurrency_policy = None
     DATE_FORMATS = ['%a %b %d %H:%M:%S %Y', ]
     CONNECTION_RETRY_LIMIT = 0
 
@@ -463,6 +864,42 @@ class Client(Logged):
         for old, new in new_keys.items():
             headers[new] = headers.pop(old)
 
+    def _get_worker_pool(self, name='transfers', size=None):
+        """:param name: (str) separate jobs that should not compete for the
+            same threads (e.g., hashing and transfers) in different pools
+
+        :param size: (int) the pool size (default: MAX_THREADS)
+
+        :returns: (WorkerPool) the named worker threads of this client
+        """
+        size = size or self.MAX_THREADS
+        with _worker_pool_lock:
+            pools = getattr(self, '_worker_pools', None)
+            if pools is None:
+                pools = self._worker_pools = dict()
+            pool = pools.get(name, None)
+            if pool is None or pool.closed:
+                pool = pools[name] = WorkerPool(size)
+            elif pool.size != size:
+                pool.resize(size)
+            return pool
+
+    def _submit(self, method, *args, **kwargs):
+        """Run method(*args, **kwargs) in a worker thread of this client
+
+        :returns: (Future)
+        """
+        return self._get_worker_pool().submit(method, *args, **kwargs)
+
+    def shutdown_workers(self, wait=True):
+        """Cancel pending asynchronous operations and stop the worker threads
+        e.g., on a KeyboardInterrupt. Running operations are not interrupted.
+
+        :param wait: (bool) block until running operations are finished
+        """
+        for pool in getattr(self, '_worker_pools', dict()).values():
+            pool.shutdown(wait)
+
     def _init_thread_limit(self, limit=1):
         assert isinstance(limit, int) and limit > 0, 'Thread limit not a +int'
         self._thread_limit = limit
@@ -491,6 +928,73 @@ class Client(Logged):
             return []
         return threadlist
 
+    def _get_concurrency_policy(self):
+        """:returns: (ConcurrencyPolicy) the concurrency_policy of this client,
+            or a new CONCURRENCY_POLICY if not set
+        """
+        if self.concurrency_policy is None:
+            self.concurrency_policy = self.CONCURRENCY_POLICY()
+        return self.concurrency_policy
+
+    def _sliding_window(
+            self, futures, pool='transfers', size=None, policy=None):
+        """Run futures in a worker pool, keeping up to _thread_limit of them
+        in flight: a new one is started as soon as any other one is finished.
+        The limit is set and adapted by the concurrency policy, up to the
+        size of the pool.
+
+        :param futures: (iterable of Future) not yet scheduled futures. It is
+            consumed lazily, so jobs are prepared (e.g., data are read) only
+            when there is a free slot for them
+
+        :param pool: (str) the name of the worker pool
+
+        :param size: (int) the pool size (default: MAX_THREADS)
+
+        :param policy: (ConcurrencyPolicy) default: the concurrency policy of
+            this client
+
+        :returns: (generator of Future) finished futures, in order of
+            completion. If the generator is closed early (e.g., the caller
+            raises an error), the futures in flight are canceled or waited
+            for, so that no job keeps running unobserved
+        """
+        pool = self._get_worker_pool(pool, size)
+        policy = policy or self._get_concurrency_policy()
+        policy.reset(pool.size)
+        self._init_thread_limit(policy.limit)
+        finished = Queue()
+        futures = iter(futures)
+        flying, exhausted = set(), False
+        try:
+            while True:
+                while len(flying) < self._thread_limit and not exhausted:
+                    try:
+                        future = next(futures)
+                    except StopIteration:
+                        exhausted = True
+                        break
+                    future.add_done_callback(finished.put)
+                    flying.add(future)
+                    pool.put(future)
+                if not flying:
+                    break
+                while True:
+                    try:
+                        future = finished.get(timeout=1.0)
+                        break
+                    except Empty:
+                        continue
+                flying.discard(future)
+                policy.update(future)
+                self._thread_limit = policy.limit
+                yield future
+        finally:
+            for future in flying:
+                future.cancel()
+            for future in flying:
+                future.join()
+
     def async_run(self, method, kwarg_list):
         """Fire threads of operations
 
@@ -502,29 +1006,9 @@ class Client(Logged):
         :returns: (list) the results of each method call w.r. to the order of
             kwarg_list
         """
-        flying, results = {}, {}
-        self._init_thread_limit()
-        for index, kwargs in enumerate(kwarg_list):
-            self._watch_thread_limit(flying.values())
-            flying[index] = SilentEvent(method=method, **kwargs)
-            flying[index].start()
-            unfinished = {}
-            for key, thread in flying.items():
-                if thread.isAlive():
-                    unfinished[key] = thread
-                elif thread.exception:
-                    raise thread.exception
-                else:
-                    results[key] = thread.value
-            flying = unfinished
+        futures = [self._submit(method, **kwargs) for kwargs in kwarg_list]
         sendlog.debug('- - - wait for threads to finish')
-        for key, thread in flying.items():
-            if thread.isAlive():
-                thread.join()
-            if thread.exception:
-                raise thread.exception
-            results[key] = thread.value
-        return results.values()
+        return [future.result() for future in futures]
 
     def set_header(self, name, value, iff=True):
         """Set a header 'name':'value'"""
@@ -543,7 +1027,9 @@ class Client(Logged):
         Requests are commited to and performed by Request/ResponseManager
         These classes perform a lazy http request. Present method, by default,
         enforces them to perform the http call. Hint: call present method with
-        success=None to get a non-performed ResponseManager object.
+        success=None to get a non-performed ResponseManager object, or with
+        stream=True to read the response body through its read, iter_content
+        or readinto methods (the response must then be exhausted or closed).
         """
         assert isinstance(method, str) or isinstance(method, unicode)
         assert method
@@ -555,6 +1041,7 @@ class Client(Logged):
             params.update(async_params)
             success = kwargs.pop('success', 200)
             data = kwargs.pop('data', None)
+            stream = kwargs.pop('stream', False)
             headers.setdefault('X-Auth-Token', self.token)
             if 'json' in kwargs:
                 data = dumps(kwargs.pop('json'))
@@ -574,6 +1061,7 @@ class Client(Logged):
                 req,
                 poolsize=self.poolsize,
                 connection_retry_limit=self.CONNECTION_RETRY_LIMIT)
+            r.stream = stream
             r.headers_to_decode = self.response_headers
             r.header_prefices = self.response_header_prefices
             r.LOG_TOKEN, r.LOG_DATA, r.LOG_PID = (
@@ -590,9 +1078,13 @@ class Client(Logged):
                 log.debug(u'Client caught error %s (%s)' % (r, type(r)))
                 status_msg = getattr(r, 'status', '')
                 try:
+                    #  A streamed body is read here, which also gives its
+                    #  connection back to the pool
                     message = u'%s %s\n' % (status_msg, r.text)
                 except Exception:
                     message = u'%s %s\n' % (status_msg, r)
+                finally:
+                    r.close()
                 status = getattr(r, 'status_code', getattr(r, 'status', 0))
                 raise ClientError(message, status=status)
         return r
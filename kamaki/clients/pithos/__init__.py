@@ -31,36 +31,212 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.
 
-from threading import enumerate as activethreads
-
+import os
+import sys
+from errno import ENXIO, EINVAL
 from os import fstat
+from stat import S_ISREG
+from mmap import mmap, ACCESS_READ
+from collections import deque, OrderedDict
+from multiprocessing import cpu_count
 from hashlib import new as newhashlib
 from time import time
 from StringIO import StringIO
+from copy import copy
+from tempfile import TemporaryFile
 from logging import getLogger
 
-from binascii import hexlify
-
-from kamaki.clients import SilentEvent
+from kamaki.clients import Future, ConcurrencyPolicy
 from kamaki.clients.pithos.rest_api import PithosRestClient
 from kamaki.clients.storage import ClientError
-from kamaki.clients.utils import path4url, filter_in, readall
+from kamaki.clients.utils import (
+    path4url, filter_in, readall, pread, pwrite, FileSlice)
 
 LOG = getLogger(__name__)
 
+#  lseek whence values to find the holes of sparse files. Python 2 does not
+#  define them, but their values are known on Linux
+_SEEK_DATA = getattr(os, 'SEEK_DATA', 3 if sys.platform.startswith(
+    'linux') else None)
+_SEEK_HOLE = getattr(os, 'SEEK_HOLE', 4 if _SEEK_DATA == 3 else None)
+
 
-def _dump_buffer(buffer_, destination):
-    """Append buffer to destination (file descriptor)"""
-    destination.write(buffer_)
-    destination.flush()
+def _cpu_count():
+    try:
+        return cpu_count()
+    except NotImplementedError:
+        return 1
 
 
 def _pithos_hash(block, blockhash):
+    """:param block: (str or memoryview) it is hashed without copying,
+        unless there are trailing zeros to strip
+    """
     h = newhashlib(blockhash)
-    h.update(block.rstrip('\x00'))
+    if block and block[-1] == '\x00':
+        if not isinstance(block, basestring):
+            block = block.tobytes()
+        block = block.rstrip('\x00')
+    h.update(block)
     return h.hexdigest()
 
 
+def _is_regular_file(fileobj):
+    """:returns: (bool) if fileobj is open on a regular file, i.e., it is not
+        a pipe, a socket, a terminal or an in-memory file
+    """
+    try:
+        return S_ISREG(fstat(fileobj.fileno()).st_mode)
+    except (AttributeError, ValueError, EnvironmentError):
+        return False
+
+
+def _map_file(fileobj):
+    """:returns: a read-only memory map of fileobj, or None if it is not a
+        regular (non-empty) file or it cannot be mapped
+    """
+    try:
+        if _is_regular_file(fileobj):
+            return mmap(fileobj.fileno(), 0, access=ACCESS_READ)
+    except (ValueError, OverflowError, EnvironmentError):
+        pass
+    return None
+
+
+def _file_slice(fileobj, offset=None, size=None):
+    """:returns: a FileSlice of a regular file, from offset (by default, the
+        current file position), or None if fileobj is not a regular file
+    """
+    if _is_regular_file(fileobj):
+        return FileSlice(
+            fileobj, fileobj.tell() if offset is None else offset, size)
+    return None
+
+
+def _preallocate(fd, size, sparse=False):
+    """Allocate disk space for a file of size bytes, or (if the system or the
+    file system does not support it, or sparse is set) at least extend it to
+    size, sparsely
+    """
+    if fstat(fd).st_size >= size:
+        return
+    if not sparse:
+        try:
+            os.posix_fallocate(fd, 0, size)
+            return
+        except (AttributeError, OSError):
+            pass
+    os.ftruncate(fd, size)
+
+
+def _data_ranges(fileobj, start, size):
+    """Find the data regions of a sparse file, with SEEK_DATA/SEEK_HOLE
+
+    :returns: (list) of (begin, end) offsets of the data in [start,
+        start + size), or None if fileobj is not a regular file, it has no
+        holes in that range or the system cannot tell
+    """
+    if _SEEK_DATA is None or not _is_regular_file(fileobj):
+        return None
+    fd, end, ranges = fileobj.fileno(), start + size, []
+    position = os.lseek(fd, 0, os.SEEK_CUR)
+    try:
+        offset = start
+        while offset < end:
+            try:
+                data = os.lseek(fd, offset, _SEEK_DATA)
+            except OSError as oe:
+                if oe.errno == ENXIO:
+                    break
+                raise
+            if data >= end:
+                break
+            offset = min(os.lseek(fd, data, _SEEK_HOLE), end)
+            ranges.append((data, offset))
+    except OSError as oe:
+        if oe.errno != EINVAL:
+            LOG.debug('Cannot find holes in %s: %s' % (fileobj, oe))
+        return None
+    finally:
+        os.lseek(fd, position, os.SEEK_SET)
+    if ranges == [(start, end)]:
+        return None
+    return ranges
+
+
+def _in_hole(ranges, offset, size):
+    """:param ranges: (list) of data ranges (see _data_ranges), in order; the
+        ranges ending before offset are removed, so that successive calls
+        with increasing offsets are cheap
+    :returns: (bool) if [offset, offset + size) contains no data
+    """
+    while ranges and ranges[0][1] <= offset:
+        ranges.pop(0)
+    return not (ranges and ranges[0][0] < offset + size)
+
+
+def _mapped_block(fmap, offset, size):
+    """:returns: (memoryview) a slice of a memory map, without copying
+
+    The slice keeps the map alive, so the map is never closed explicitly
+    """
+    return memoryview(buffer(fmap, offset, size))
+
+
+def _block_runs(blocks, max_blocks):
+    """Group adjacent block ranges, so that each group is requested at once
+
+    :param blocks: (iterable) of (start, end, whole, item) sorted by start,
+        where only whole blocks (not cut by a range) are grouped together
+
+    :param max_blocks: (int) maximum number of blocks in a group
+
+    :returns: (generator) of lists of adjacent (start, end, whole, item)
+    """
+    run = []
+    for block in blocks:
+        start, end, whole, item = block
+        if run and not (
+                whole and run[-1][2] and run[-1][1] + 1 == start and (
+                    len(run) < max_blocks)):
+            yield run
+            run = []
+        run.append(block)
+    if run:
+        yield run
+
+
+def _range_size(a_range):
+    """:returns: (int) the number of bytes in a range string of the form
+        x-y[,x'-y'[,...]], as returned by _range_up
+    """
+    size = 0
+    for some_range in filter(None, a_range.split(',')):
+        v0, v1 = some_range.split('-')
+        size += int(v1) - int(v0) + 1
+    return size
+
+
+def _content_length(r):
+    """:returns: (int) the Content-Length of a response, None if not known"""
+    try:
+        return int(r.headers['content-length'])
+    except (KeyError, TypeError, ValueError):
+        return None
+
+
+def _block_ranges(blocksize, total_size, nblocks, a_range):
+    """:returns: (generator) of (blockid, start, end, block range string)
+        for each block of an object, in order (see _range_up)
+    """
+    for blockid in range(nblocks):
+        start = blocksize * blockid
+        end = min(start + blocksize, total_size) - 1
+        if end < start:
+            continue
+        yield blockid, start, end, _range_up(start, end, total_size, a_range)
+
+
 def _range_up(start, end, max_value, a_range):
     """
     :param start: (int) the window bottom
@@ -111,6 +287,21 @@ def _range_up(start, end, max_value, a_range):
 class PithosClient(PithosRestClient):
     """Synnefo Pithos+ API client"""
 
+    HASH_THREADS = _cpu_count()
+
+    # A kamaki.clients.pithos.cache.HashCache, to remember local block hashes
+    hash_cache = None
+    # A kamaki.clients.pithos.cache.BlockStore, to reuse downloaded blocks
+    block_store = None
+    # A kamaki.clients.pithos.cache.UploadJournal, to resume interrupted
+    # uploads (see upload_object)
+    upload_journal = None
+    # Maximum number of adjacent blocks to download with one range request
+    MAX_RANGE_BLOCKS = 1
+    # Bytes of hashed blocks kept in memory, so that they are not read again
+    # if they must be uploaded. Memory mapped files are not buffered.
+    UPLOAD_BUFFER_SIZE = 64 * 1024 * 1024
+
     def __init__(self, endpoint_url, token, account=None, container=None):
         super(PithosClient, self).__init__(
             endpoint_url, token, account, container)
@@ -212,7 +403,11 @@ class PithosClient(PithosRestClient):
                 raise ClientError(msg, 1)
             f = StringIO(data)
         else:
-            data = readall(f, size) if size else f.read()
+            data = _file_slice(f, size=size)
+            if data is None:
+                data = readall(f, size) if size else f.read()
+            else:
+                f.seek(data.offset + len(data))
         r = self.object_put(
             obj,
             data=data,
@@ -265,11 +460,6 @@ class PithosClient(PithosRestClient):
         return r.headers
 
     # upload_* auxiliary methods
-    def _put_block_async(self, data, hash):
-        event = SilentEvent(method=self._put_block, data=data, hash=hash)
-        event.start()
-        return event
-
     def _put_block(self, data, hash):
         r = self.container_post(
             update=True,
@@ -330,69 +520,221 @@ class PithosClient(PithosRestClient):
             success=success)
         return (None if r.status_code == 201 else r.json), r.headers
 
+    def _cached_hashes(self, blocksize, blockhash, size, nblocks, fileobj):
+        """:returns: (list) the hashes of the next size bytes of fileobj, if
+            they are all in the hash cache, None otherwise
+        """
+        if not self.hash_cache:
+            return None
+        hashes = self.hash_cache.get(
+            fileobj, fileobj.tell(), size, blocksize, blockhash)
+        if hashes and len(hashes) == nblocks and None not in hashes:
+            return hashes
+        return None
+
+    def _hash_blocks(self, blocksize, blockhash, size, nblocks, fileobj):
+        """Read blocks sequentially and hash them in HASH_THREADS threads.
+        A bounded number of blocks is read ahead, waiting to be hashed.
+        Hashes found in the hash cache are not calculated again.
+        Regular files are memory mapped, so blocks are not copied in memory.
+        Blocks in the holes of sparse files are known to be zeros, so they
+        are not hashed.
+
+        :returns: (generator) of (offset, block, hash), in file order
+        """
+        offset = 0
+        fmap = _map_file(fileobj)
+        start = fileobj.tell() if (fmap or self.hash_cache) else 0
+
+        def read(bytes):
+            if fmap:
+                return _mapped_block(fmap, start + offset, bytes)
+            return readall(fileobj, bytes)
+
+        cached = self._cached_hashes(
+            blocksize, blockhash, size, nblocks, fileobj)
+        if cached:
+            for hash in cached:
+                block = read(min(blocksize, size - offset))
+                yield offset, block, hash
+                offset += len(block)
+        else:
+            calculated = []
+            pool = self._get_worker_pool('hashes', self.HASH_THREADS)
+            pending = deque()
+            holes = _data_ranges(fileobj, start, size) if fmap else None
+            if holes is not None:
+                zero = Future(_pithos_hash, '', blockhash)
+                zero.run()
+            for i in xrange(nblocks):
+                block = read(min(blocksize, size - offset))
+                if not block:
+                    break
+                if holes is not None and _in_hole(
+                        holes, start + offset, len(block)):
+                    future = zero
+                else:
+                    future = pool.submit(_pithos_hash, block, blockhash)
+                pending.append((offset, block, future))
+                offset += len(block)
+                if len(pending) > 2 * pool.size:
+                    block_offset, block, future = pending.popleft()
+                    calculated.append(future.result())
+                    yield block_offset, block, calculated[-1]
+            while pending:
+                block_offset, block, future = pending.popleft()
+                calculated.append(future.result())
+                yield block_offset, block, calculated[-1]
+        if fmap:
+            fileobj.seek(start + offset)
+        msg = ('Failed to calculate uploading blocks: '
+               'read bytes(%s) != requested size (%s)' % (offset, size))
+        assert offset == size, msg
+        if self.hash_cache and not cached:
+            self.hash_cache.set(
+                fileobj, start, size, blocksize, blockhash, calculated)
+
     def _calculate_blocks_for_upload(
             self, blocksize, blockhash, size, nblocks, hashes, hmap, fileobj,
-            hash_cb=None):
-        offset = 0
+            hash_cb=None, buffered=None, journaled=None):
+        """
+        :param buffered: (OrderedDict) if given, keep the most recently read
+            blocks here ({hash: block}), up to UPLOAD_BUFFER_SIZE bytes
+
+        :param journaled: (list) the block hashes, if already known (e.g.,
+            from an upload journal), so that the file is not read at all
+        """
+        buffered_size = 0
         if hash_cb:
             hash_gen = hash_cb(nblocks)
             hash_gen.next()
 
-        for i in xrange(nblocks):
-            block = readall(fileobj, min(blocksize, size - offset))
-            bytes = len(block)
-            if bytes <= 0:
-                break
-            hash = _pithos_hash(block, blockhash)
+        cached = journaled or self._cached_hashes(
+            blocksize, blockhash, size, nblocks, fileobj)
+        if cached:
+            for i, hash in enumerate(cached):
+                offset = i * blocksize
+                hashes.append(hash)
+                hmap[hash] = (offset, min(blocksize, size - offset))
+                if hash_cb:
+                    hash_gen.next()
+            return
+
+        for offset, block, hash in self._hash_blocks(
+                blocksize, blockhash, size, nblocks, fileobj):
             hashes.append(hash)
-            hmap[hash] = (offset, bytes)
-            offset += bytes
+            hmap[hash] = (offset, len(block))
             if hash_cb:
                 hash_gen.next()
-        msg = ('Failed to calculate uploading blocks: '
-               'read bytes(%s) != requested size (%s)' % (offset, size))
-        assert offset == size, msg
+            if buffered is not None and isinstance(block, str) and (
+                    hash not in buffered):
+                buffered[hash] = block
+                buffered_size += len(block)
+                while buffered_size > self.UPLOAD_BUFFER_SIZE:
+                    buffered_size -= len(buffered.popitem(last=False)[1])
+
+    def _calculate_and_upload_blocks(
+            self, blocksize, blockhash, size, nblocks, hashes, hmap, fileobj,
+            hash_cb=None, upload_gen=None, confirmed=None):
+        """Upload each block as soon as it is hashed, without asking the
+        server which blocks are missing. Blocks that fail to upload are
+        reported as missing later, when the hashmap is sent.
 
-    def _upload_missing_blocks(self, missing, hmap, fileobj, upload_gen=None):
-        """upload missing blocks asynchronously"""
+        :param confirmed: (set) hashes of blocks known to be on the server,
+            which are not uploaded. It is updated with the uploaded blocks
+        """
+        confirmed = set() if confirmed is None else confirmed
+        if hash_cb:
+            hash_gen = hash_cb(nblocks)
+            hash_gen.next()
 
-        self._init_thread_limit()
+        def upload_next():
+            if upload_gen:
+                try:
+                    upload_gen.next()
+                except Exception:
+                    pass
 
-        flying = []
-        failures = []
-        for hash in missing:
-            offset, bytes = hmap[hash]
-            fileobj.seek(offset)
-            data = readall(fileobj, bytes)
-            r = self._put_block_async(data, hash)
-            flying.append(r)
-            unfinished = self._watch_thread_limit(flying)
-            for thread in set(flying).difference(unfinished):
-                if thread.exception:
-                    failures.append(thread)
-                    if isinstance(
-                            thread.exception,
-                            ClientError) and thread.exception.status == 502:
-                        self.POOLSIZE = self._thread_limit
-                elif thread.isAlive():
-                    flying.append(thread)
-                elif upload_gen:
-                    try:
-                        upload_gen.next()
-                    except Exception:
-                        pass
-            flying = unfinished
-
-        for thread in flying:
-            thread.join()
-            if thread.exception:
-                failures.append(thread)
-            elif upload_gen:
+        def blocks():
+            for offset, block, hash in self._hash_blocks(
+                    blocksize, blockhash, size, nblocks, fileobj):
+                hashes.append(hash)
+                if hash_cb:
+                    hash_gen.next()
+                if hash in hmap:
+                    upload_next()
+                    continue
+                hmap[hash] = (offset, len(block))
+                if hash in confirmed:
+                    upload_next()
+                    continue
+                future = Future(self._put_block, data=block, hash=hash)
+                future.size = len(block)
+                yield future
+
+        for future in self._sliding_window(blocks()):
+            if not future.exception:
+                confirmed.add(future.kwargs['hash'])
+                upload_next()
+
+    def _upload_missing_blocks(
+            self, missing, hmap, fileobj, upload_gen=None, buffered=None,
+            confirmed=None, confirm_cb=None):
+        """upload missing blocks asynchronously
+
+        :param buffered: (dict) {hash: block} of blocks already in memory,
+            uploaded blocks are removed from it
+
+        :param confirmed: (set) hashes of blocks known to be on the server
+            (e.g., uploaded for another object meanwhile), which are not
+            uploaded again. It is updated with the uploaded blocks
+
+        :param confirm_cb: (callable) called with the hash of each uploaded
+            block, as soon as it is uploaded
+        """
+        buffered = dict() if buffered is None else buffered
+        confirmed = set() if confirmed is None else confirmed
+        fmap = _map_file(fileobj)
+        sliceable = fmap is None and _file_slice(fileobj, 0) is not None
+
+        def upload_next():
+            if upload_gen:
                 try:
                     upload_gen.next()
                 except Exception:
                     pass
 
+        def blocks():
+            for hash in missing:
+                if hash in confirmed:
+                    buffered.pop(hash, None)
+                    upload_next()
+                    continue
+                offset, bytes = hmap[hash]
+                if hash in buffered:
+                    data = buffered[hash]
+                elif fmap:
+                    data = _mapped_block(fmap, offset, bytes)
+                elif sliceable:
+                    data = FileSlice(fileobj, offset, bytes)
+                else:
+                    fileobj.seek(offset)
+                    data = readall(fileobj, bytes)
+                future = Future(self._put_block, data=data, hash=hash)
+                future.size = bytes
+                yield future
+
+        failures = []
+        for future in self._sliding_window(blocks()):
+            if future.exception:
+                failures.append(future)
+                continue
+            buffered.pop(future.kwargs['hash'], None)
+            confirmed.add(future.kwargs['hash'])
+            if confirm_cb:
+                confirm_cb(future.kwargs['hash'])
+            upload_next()
+
         return [failure.kwargs['hash'] for failure in failures]
 
     def upload_object(
@@ -409,7 +751,10 @@ class PithosClient(PithosRestClient):
             sharing=None,
             public=None,
             container_info_cache=None,
-            target_account=None):
+            target_account=None,
+            pipelined=False,
+            confirmed=None,
+            resume=False):
         """Upload an object using multiple connections (threads)
 
         :param obj: (str) remote object path
@@ -447,8 +792,42 @@ class PithosClient(PithosRestClient):
         :param target_account: (str) the UUID of the account the object will be
             allocated at, if different to the client account (e.g., when
             user A uploads something to a location owned by user B)
+
+        :param pipelined: (bool) upload each block while the next ones are
+            being hashed, instead of hashing the whole file first. Overlaps
+            disk, CPU and network, but blocks already stored on the server
+            are uploaded again
+
+        :param confirmed: (set) hashes of blocks known to be on the server,
+            e.g., shared by the uploads of a session. These blocks are never
+            uploaded, and the set is updated with the blocks of this object
+
+        :param resume: (bool) resume an interrupted upload of f to obj, if
+            it is in the upload journal: the block hashes are not calculated
+            and the blocks it confirmed are not uploaded again
+
+        If upload_journal is set, the progress of uploads of more than one
+        block is journaled (unless pipelined), so that they can be resumed.
+
+        If f is not a regular file (e.g., a pipe) and size is not given, it
+        is uploaded with upload_from_stream
         """
         self._assert_container()
+        if size is None and not _is_regular_file(f):
+            return self.upload_from_stream(
+                obj, f,
+                etag=etag,
+                if_etag_match=if_etag_match,
+                if_not_exist=if_not_exist,
+                content_encoding=content_encoding,
+                content_disposition=content_disposition,
+                content_type=content_type,
+                sharing=sharing,
+                public=public,
+                container_info_cache=container_info_cache,
+                target_account=target_account,
+                confirmed=confirmed)
+        confirmed = set() if confirmed is None else confirmed
 
         block_info = (
             blocksize, blockhash, size, nblocks
@@ -458,12 +837,45 @@ class PithosClient(PithosRestClient):
         hashes, hmap = [], {}
         content_type = content_type or 'application/octet-stream'
 
-        self._calculate_blocks_for_upload(
-            *block_info,
-            hashes=hashes,
-            hmap=hmap,
-            fileobj=f,
-            hash_cb=hash_cb)
+        journal = self.upload_journal if (
+            nblocks > 1 and not pipelined) else None
+        journal_target = (
+            self.endpoint_url, target_account or self.account,
+            self.container, obj, f.tell(), size, blocksize, blockhash)
+        journaled = journal.get(f, journal_target) if (
+            journal and resume) else None
+        if journaled:
+            LOG.debug('Resume upload, %s of %s blocks are confirmed' % (
+                len(journaled[1]), nblocks))
+            confirmed.update(journaled[1])
+
+        def confirm(hash):
+            journal.confirm(f, journal_target, [hash])
+
+        upload_gen, buffered = None, OrderedDict()
+        if pipelined:
+            if upload_cb:
+                upload_gen = upload_cb(nblocks)
+                upload_gen.next()
+            self._calculate_and_upload_blocks(
+                *block_info,
+                hashes=hashes,
+                hmap=hmap,
+                fileobj=f,
+                hash_cb=hash_cb,
+                upload_gen=upload_gen,
+                confirmed=confirmed)
+        else:
+            self._calculate_blocks_for_upload(
+                *block_info,
+                hashes=hashes,
+                hmap=hmap,
+                fileobj=f,
+                hash_cb=hash_cb,
+                buffered=buffered,
+                journaled=journaled[0] if journaled else None)
+            if journal and not journaled:
+                journal.start(f, journal_target, hashes)
 
         hashmap = dict(bytes=size, hashes=hashes)
         missing, obj_headers = self.use_alternative_account(
@@ -479,9 +891,12 @@ class PithosClient(PithosRestClient):
             alternative_account=target_account)
 
         if missing is None:
+            confirmed.update(hashes)
+            if journal:
+                journal.remove(f, journal_target)
             return obj_headers
 
-        if upload_cb:
+        if upload_cb and not upload_gen:
             upload_gen = upload_cb(len(hashmap['hashes']))
             for i in range(len(hashmap['hashes']) + 1 - len(missing)):
                 try:
@@ -489,15 +904,14 @@ class PithosClient(PithosRestClient):
                 except Exception:
                     LOG.debug('Progress bar failure')
                     break
-        else:
-            upload_gen = None
 
         retries = 7
         while retries:
             LOG.debug('%s blocks missing' % len(missing))
             num_of_blocks = len(missing)
             missing = self._upload_missing_blocks(
-                missing, hmap, f, upload_gen)
+                missing, hmap, f, upload_gen, buffered, confirmed,
+                confirm_cb=confirm if journal else None)
             if missing:
                 if num_of_blocks == len(missing):
                     retries -= 1
@@ -529,8 +943,224 @@ class PithosClient(PithosRestClient):
             public=public,
             success=201,
             alternative_account=target_account)
+        confirmed.update(hashes)
+        if journal:
+            journal.remove(f, journal_target)
         return r.headers
 
+    def upload_from_stream(
+            self, obj, f,
+            etag=None,
+            if_etag_match=None,
+            if_not_exist=None,
+            content_encoding=None,
+            content_disposition=None,
+            content_type=None,
+            sharing=None,
+            public=None,
+            container_info_cache=None,
+            target_account=None,
+            confirmed=None):
+        """Upload an object from a stream (e.g., a pipe), which is read once,
+        up to its end. Each block is hashed and uploaded as soon as it is
+        read, so that only the blocks being uploaded (up to MAX_THREADS) are
+        kept in memory. The object is created with its hashmap at the end
+
+        :param obj: (str) remote object path
+
+        :param f: an open stream, not necessarily seekable
+
+        :param etag: (str)
+
+        :param if_etag_match: (str) Push that value to if-match header at file
+            creation
+
+        :param if_not_exist: (bool) If true, the object is created only if it
+            does not exist remotely
+
+        :param content_encoding: (str)
+
+        :param content_disposition: (str)
+
+        :param content_type: (str)
+
+        :param sharing: {'read':[user and/or grp names],
+            'write':[usr and/or grp names]}
+
+        :param public: (bool)
+
+        :param container_info_cache: (dict) if given, avoid redundant calls to
+            server for container info (block size and hash information)
+
+        :param target_account: (str) the UUID of the account the object will be
+            allocated at, if different to the client account
+
+        :param confirmed: (set) hashes of blocks known to be on the server,
+            which are not uploaded. It is updated with the uploaded blocks
+
+        :returns: (dict) created object metadata
+        """
+        self._assert_container()
+        confirmed = set() if confirmed is None else confirmed
+        blocksize, blockhash, _, _ = self.use_alternative_account(
+            self._get_file_block_info, f, 0, container_info_cache,
+            alternative_account=target_account)
+        hashes, sent, size = [], set(), [0]
+
+        def blocks():
+            block = readall(f, blocksize)
+            while block:
+                hash = _pithos_hash(block, blockhash)
+                hashes.append(hash)
+                size[0] += len(block)
+                if not (hash in sent or hash in confirmed):
+                    sent.add(hash)
+                    future = Future(self._put_block, data=block, hash=hash)
+                    future.size = len(block)
+                    yield future
+                block = readall(f, blocksize)
+
+        for future in self._sliding_window(blocks()):
+            if future.exception:
+                LOG.debug('Retry block %s after %s' % (
+                    future.kwargs['hash'], future.exception))
+                self._put_block(**future.kwargs)
+            confirmed.add(future.kwargs['hash'])
+
+        r = self.use_alternative_account(
+            self.object_put,
+            obj,
+            format='json',
+            hashmap=True,
+            content_type=content_type or 'application/octet-stream',
+            content_encoding=content_encoding,
+            content_disposition=content_disposition,
+            if_etag_match=if_etag_match,
+            if_etag_not_match='*' if if_not_exist else None,
+            etag=etag,
+            json=dict(bytes=size[0], hashes=hashes),
+            permissions=sharing,
+            public=public,
+            success=201,
+            alternative_account=target_account)
+        confirmed.update(hashes)
+        return r.headers
+
+    def _clone(self):
+        """:returns: (PithosClient) a copy of this client, with a request
+            state of its own, so that it can be used by another thread. It
+            shares the worker pools of this client
+        """
+        self._get_worker_pool()
+        client = copy(self)
+        client.headers, client.params = dict(), dict()
+        client.concurrency_policy = None
+        client.__dict__.pop('progress_bar_gen', None)
+        return client
+
+    def _upload_file(self, local_path, obj, small_files=True, **kwargs):
+        """Upload a local file, with a single request if it fits in a block
+        and no conditions are set, with upload_object otherwise. A single
+        block which is in kwargs['confirmed'] is not uploaded again: only the
+        hashmap of the object is sent
+        """
+        with open(local_path, 'rb') as f:
+            if small_files and not (
+                    kwargs.get('if_etag_match') or kwargs.get('if_not_exist')):
+                target_account = kwargs.get('target_account')
+                blocksize, blockhash, size, nblocks = (
+                    self.use_alternative_account(
+                        self._get_file_block_info, f, kwargs.get('size'),
+                        kwargs.get('container_info_cache'),
+                        alternative_account=target_account))
+                confirmed, block_hash = kwargs.get('confirmed'), None
+                if nblocks == 1 and confirmed is not None:
+                    block_hash = _pithos_hash(readall(f, size), blockhash)
+                    f.seek(0)
+                if nblocks <= 1 and block_hash not in (confirmed or ()):
+                    self.account = target_account or self.account
+                    headers = self.upload_object_unchunked(
+                        obj, f,
+                        size=size,
+                        etag=kwargs.get('etag'),
+                        content_encoding=kwargs.get('content_encoding'),
+                        content_disposition=kwargs.get('content_disposition'),
+                        content_type=kwargs.get(
+                            'content_type') or 'application/octet-stream',
+                        sharing=kwargs.get('sharing'),
+                        public=kwargs.get('public'))
+                    if block_hash:
+                        confirmed.add(block_hash)
+                    return headers
+            return self.upload_object(obj, f, **kwargs)
+
+    def upload_objects(
+            self, sources, upload_cb=None, max_files=None, small_files=True,
+            **kwargs):
+        """Upload many local files at the same time. Each file is uploaded by
+        a client of its own, in a worker pool of files, while the blocks of
+        all files share the transfer and hash worker pools of this client, so
+        that MAX_THREADS bounds the block transfers of all files together
+
+        :param sources: (list) of (local file path, remote object path, dict
+            of upload_object keyword arguments for this file only, e.g.,
+            content_type). Each file is open only while it is uploaded
+
+        :param upload_cb: optional progress.bar object for uploading, which
+            advances once per uploaded file
+
+        :param max_files: (int) how many files to upload at the same time
+            (default: MAX_THREADS)
+
+        :param small_files: (bool) upload each file that fits in a block with
+            a single request, instead of through its hashmap
+
+        :param kwargs: upload_object keyword arguments for all files. The
+            blocks of all files share a set of confirmed hashes, unless one
+            is given, so that each block is uploaded once
+
+        :returns: (generator) of (local path, remote path, object headers),
+            in order of completion. If a file fails, the next files are not
+            uploaded, and the error is raised when the uploads in progress
+            are finished
+        """
+        self._assert_container()
+        kwargs.setdefault('container_info_cache', dict())
+        kwargs.setdefault('confirmed', set())
+        if upload_cb:
+            self.progress_bar_gen = upload_cb(len(sources))
+            self._cb_next()
+
+        def jobs():
+            for local_path, obj, params in sources:
+                yield Future(
+                    self._clone()._upload_file, local_path, obj,
+                    small_files=small_files, **dict(kwargs, **params))
+
+        for future in self._run_file_jobs(jobs(), max_files):
+            self._cb_next()
+            yield future.args[0], future.args[1], future.value
+
+    def _run_file_jobs(self, futures, max_files=None):
+        """Run futures in the worker pool of files, up to max_files (default:
+        MAX_THREADS) at a time
+
+        :param futures: (iterable of Future) consumed lazily
+
+        :returns: (generator of Future) finished futures, in order of
+            completion. The exception of the first failed one is raised, as
+            soon as the other ones in progress are finished
+        """
+        window = self._sliding_window(
+            futures, 'files', max_files, ConcurrencyPolicy())
+        try:
+            for future in window:
+                if future.exception:
+                    raise future.exception
+                yield future
+        finally:
+            window.close()
+
     def upload_from_string(
             self, obj, input_str,
             hash_cb=None,
@@ -616,27 +1246,19 @@ class PithosClient(PithosRestClient):
 
         tries = 7
         old_failures = 0
+
+        def blocks():
+            for hash in missing:
+                future = Future(self._put_block, data=hmap[hash][1], hash=hash)
+                future.size = len(hmap[hash][1])
+                yield future
+
         try:
             while tries and missing:
-                flying = []
                 failures = []
-                for hash in missing:
-                    offset, block = hmap[hash]
-                    bird = self._put_block_async(block, hash)
-                    flying.append(bird)
-                    unfinished = self._watch_thread_limit(flying)
-                    for thread in set(flying).difference(unfinished):
-                        if thread.exception:
-                            failures.append(thread.kwargs['hash'])
-                        if thread.isAlive():
-                            flying.append(thread)
-                        else:
-                            self._cb_next()
-                    flying = unfinished
-                for thread in flying:
-                    thread.join()
-                    if thread.exception:
-                        failures.append(thread.kwargs['hash'])
+                for future in self._sliding_window(blocks()):
+                    if future.exception:
+                        failures.append(future.kwargs['hash'])
                     self._cb_next()
                 missing = failures
                 if missing and len(missing) == old_failures:
@@ -646,8 +1268,7 @@ class PithosClient(PithosRestClient):
                 raise ClientError('%s blocks failed to upload' % len(missing))
         except KeyboardInterrupt:
             LOG.debug('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.shutdown_workers()
             raise
         self._cb_next()
 
@@ -706,78 +1327,331 @@ class PithosClient(PithosRestClient):
                 dst.write(r.content)
                 dst.flush()
 
-    def _get_block_async(self, obj, **args):
-        event = SilentEvent(self.object_get, obj, success=(200, 206), **args)
-        event.start()
-        return event
-
     def _hash_from_file(self, fp, start, size, blockhash):
-        fp.seek(start)
-        block = readall(fp, size)
-        h = newhashlib(blockhash)
-        h.update(block.strip('\x00'))
-        return hexlify(h.digest())
+        return _pithos_hash(pread(fp.fileno(), size, start), blockhash)
 
-    def _thread2file(self, flying, blockids, local_file, offset=0, **restargs):
-        """write the results of a greenleted rest call to a file
+    def _get_blocks(
+            self, obj, blocksize, nblocks, hashes=None, blockhash=None,
+            **restargs):
+        """GET a range of one or more adjacent blocks
 
-        :param offset: the offset of the file up to blocksize
-        - e.g. if the range is 10-100, all blocks will be written to
-        normal_position - 10
+        :param hashes: (list) if the blocks are whole, their hashes, so that
+            they are kept in the block store
+
+        :returns: (list) the blocks of the response
         """
-        for key, g in flying.items():
-            if g.isAlive():
-                continue
-            if g.exception:
-                raise g.exception
-            block = g.value.content
-            for block_start in blockids[key]:
-                # This should not be used in all cases
-                local_file.seek(block_start + offset)
-                local_file.write(block)
-                self._cb_next()
-            flying.pop(key)
-            blockids.pop(key)
-        local_file.flush()
+        data = self.object_get(obj, **restargs).content
+        if nblocks < 2:
+            blocks = [data]
+        elif (nblocks - 1) * blocksize < len(data) <= nblocks * blocksize:
+            data = memoryview(data)
+            blocks = [data[i * blocksize:(i + 1) * blocksize] for i in range(
+                nblocks)]
+        else:
+            raise ClientError(
+                'Expected %s blocks, got %s bytes' % (nblocks, len(data)))
+        if hashes and self.block_store:
+            for block_hash, block in zip(hashes, blocks):
+                self.block_store.put(block_hash, block, blockhash)
+        return blocks
+
+    def _read_blocks_into(
+            self, obj, view, blocksize, hashes=None, blockhash=None,
+            **restargs):
+        """GET a range of one or more adjacent blocks, streamed straight into
+        a buffer
+
+        :param view: (memoryview) exactly as large as the requested range
+
+        :param hashes: (list) if the blocks are whole, their hashes, so that
+            they are kept in the block store
+        """
+        r = self.object_get(obj, stream=True, **restargs)
+        try:
+            size = r.readinto(view)
+            if size < len(view) or r.read(1):
+                raise ClientError('Expected %s bytes, got %s%s' % (
+                    len(view), size, '' if size < len(view) else ' or more'))
+        finally:
+            r.close()
+        if hashes and self.block_store:
+            for i, block_hash in enumerate(hashes):
+                self.block_store.put(
+                    block_hash, view[i * blocksize:(i + 1) * blocksize],
+                    blockhash)
+
+    def _dump_block(
+            self, fd, blocksize, blockids, obj, hashes=None, blockhash=None,
+            **restargs):
+        """GET one or more adjacent blocks and write each of them at all its
+        positions in a file. Unless the blocks are to be kept in the block
+        store, the response is streamed to the file one chunk at a time
+
+        :param fd: (int) the file descriptor to write at
+
+        :param blockids: (list) the file positions of each block
+
+        :raises ClientError: if the response body is shorter or longer than
+            announced (or, if not announced, than the requested range)
+        """
+        nblocks = len(blockids)
+        if hashes and self.block_store:
+            blocks = self._get_blocks(
+                obj, blocksize, nblocks, hashes=hashes, blockhash=blockhash,
+                **restargs)
+            for block, positions in zip(blocks, blockids):
+                for block_start in positions:
+                    pwrite(fd, block, block_start)
+            return
+
+        r, size = self.object_get(obj, stream=True, **restargs), 0
+        expected = _content_length(r)
+        if expected is None:
+            data_range = restargs.get('async_headers', {}).get('Range', '')
+            expected = _range_size(data_range[6:]) if data_range else None
+        try:
+            for chunk in r.iter_content():
+                if size + len(chunk) > nblocks * blocksize:
+                    raise ClientError(
+                        'Expected %s blocks, got more than %s bytes' % (
+                            nblocks, nblocks * blocksize))
+                chunk = memoryview(chunk)
+                while chunk:
+                    i, block_offset = divmod(size, blocksize)
+                    piece = chunk[:blocksize - block_offset]
+                    for block_start in blockids[i]:
+                        pwrite(fd, piece, block_start + block_offset)
+                    size += len(piece)
+                    chunk = chunk[len(piece):]
+            if expected is not None and size != expected:
+                #  A body cut short does not raise, it just ends early
+                raise ClientError(
+                    'Expected %s bytes, got %s' % (expected, size))
+            if nblocks > 1 and size <= (nblocks - 1) * blocksize:
+                raise ClientError(
+                    'Expected %s blocks, got %s bytes' % (nblocks, size))
+        finally:
+            r.close()
 
     def _dump_blocks_async(
             self, obj, remote_hashes, blocksize, total_size, local_file,
-            blockhash=None, resume=False, filerange=None, **restargs):
-        file_size = fstat(local_file.fileno()).st_size if resume else 0
-        flying = dict()
+            blockhash=None, resume=False, filerange=None, saved=None,
+            local_hashes=None, **restargs):
+        """
+        :param saved: (dict) if given, it is updated with the remote hash of
+            each block (by block index) verified or written in local_file
+
+        :param local_hashes: (list) the hash of each local block, if known
+            (None for blocks which must be downloaded)
+
+        Blocks of zeros are not downloaded: they are left as holes past the
+        end of the local file, or written locally otherwise
+        """
+        fd = local_file.fileno()
+        file_size = fstat(fd).st_size if resume else 0
+        zero_hash = _pithos_hash('', blockhash) if (
+            blockhash and not filerange) else None
         blockid_dict = dict()
-        offset = 0
+        saved = dict() if saved is None else saved
+        known = local_hashes is not None
+        if not known:
+            local_hashes = (self.hash_cache.get(
+                local_file, 0, file_size, blocksize, blockhash) if (
+                    file_size and self.hash_cache) else None) or []
+
+        def is_known(blk):
+            i = blk // blocksize
+            return blk >= file_size or known or (
+                i < len(local_hashes) and local_hashes[i])
+
+        def local_hash(blk):
+            i = blk // blocksize
+            if blk >= file_size:
+                return None
+            elif i < len(local_hashes) and (known or local_hashes[i]):
+                return local_hashes[i]
+            elif known:
+                return None
+            return self._hash_from_file(local_file, blk, blocksize, blockhash)
+
+        def local_block_hashes(blockids):
+            return [local_hash(blk) for blk in blockids]
+
+        def verified():
+            """Hash local blocks in HASH_THREADS threads, a bounded number
+            of blocks ahead of the download scheduler
+
+            :returns: (generator) of (remote hash, positions, local hashes)
+            """
+            pool = self._get_worker_pool('hashes', self.HASH_THREADS)
+            pending = deque()
+
+            def pop():
+                block_hash, blockids, hashes = pending.popleft()
+                if isinstance(hashes, Future):
+                    hashes = hashes.result()
+                return block_hash, blockids, hashes
+
+            for block_hash, blockids in sorted(
+                    remote_hashes.items(), key=lambda item: item[1][0]):
+                blockids = [blk * blocksize for blk in blockids]
+                hashes = local_block_hashes(blockids) if all(
+                    [is_known(blk) for blk in blockids]) else pool.submit(
+                        local_block_hashes, blockids)
+                pending.append((block_hash, blockids, hashes))
+                while pending and (len(pending) > 2 * pool.size or not (
+                        isinstance(pending[0][2], Future) and (
+                            not pending[0][2].done()))):
+                    yield pop()
+            while pending:
+                yield pop()
+
+        def needed():
+            for block_hash, blockids, hashes in verified():
+                unsaved = [blk for blk, h in zip(
+                    blockids, hashes) if h != block_hash]
+                for blk in set(blockids).difference(unsaved):
+                    saved[blk // blocksize] = block_hash
+                self._cb_next(len(blockids) - len(unsaved))
+                if unsaved and block_hash == zero_hash:
+                    for blk in unsaved:
+                        if blk < file_size:
+                            pwrite(fd, '\x00' * min(
+                                blocksize, total_size - blk), blk)
+                        saved[blk // blocksize] = block_hash
+                    self._cb_next(len(unsaved))
+                elif unsaved:
+                    key = unsaved[0]
+                    end = total_size - 1 if (
+                        key + blocksize > total_size) else key + blocksize - 1
+                    if end < key:
+                        self._cb_next()
+                        continue
+                    data_range = _range_up(key, end, total_size, filerange)
+                    if not data_range:
+                        self._cb_next()
+                        continue
+                    whole = data_range == '%s-%s' % (key, end)
+                    block = self.block_store.get(
+                        block_hash, end - key + 1, blockhash) if (
+                            whole and self.block_store) else None
+                    if block is None:
+                        yield key, end, whole, (block_hash, unsaved)
+                        continue
+                    for blk in unsaved:
+                        pwrite(fd, block, blk)
+                        if not filerange:
+                            saved[blk // blocksize] = block_hash
+                    self._cb_next(len(unsaved))
+
+        def blocks():
+            for run in _block_runs(needed(), self.MAX_RANGE_BLOCKS):
+                start, end = run[0][0], run[-1][1]
+                data_range = '%s-%s' % (start, end) if len(run) > 1 else (
+                    _range_up(start, end, total_size, filerange))
+                restargs['async_headers'] = {'Range': 'bytes=%s' % data_range}
+                items = [block[3] for block in run]
+                hashes = [item[0] for item in items] if all(
+                    [block[2] for block in run]) else None
+                future = Future(
+                    self._dump_block, fd, blocksize,
+                    [item[1] for item in items], obj,
+                    hashes=hashes, blockhash=blockhash,
+                    success=(200, 206), **restargs)
+                future.size = end - start + 1
+                blockid_dict[future] = items
+                yield future
 
-        self._init_thread_limit()
-        for block_hash, blockids in remote_hashes.items():
-            blockids = [blk * blocksize for blk in blockids]
-            unsaved = [blk for blk in blockids if not (
-                blk < file_size and block_hash == self._hash_from_file(
-                    local_file, blk, blocksize, blockhash))]
-            self._cb_next(len(blockids) - len(unsaved))
-            if unsaved:
-                key = unsaved[0]
-                self._watch_thread_limit(flying.values())
-                self._thread2file(
-                    flying, blockid_dict, local_file, offset,
-                    **restargs)
-                end = total_size - 1 if (
-                    key + blocksize > total_size) else key + blocksize - 1
-                if end < key:
-                    self._cb_next()
-                    continue
-                data_range = _range_up(key, end, total_size, filerange)
-                if not data_range:
-                    self._cb_next()
-                    continue
-                restargs[
-                    'async_headers'] = {'Range': 'bytes=%s' % data_range}
-                flying[key] = self._get_block_async(obj, **restargs)
-                blockid_dict[key] = unsaved
+        local_file.flush()
+        if not filerange:
+            _preallocate(fd, total_size, sparse=zero_hash in remote_hashes)
+        window = self._sliding_window(blocks())
+        try:
+            for future in window:
+                if future.exception:
+                    raise future.exception
+                for block_hash, blockids in blockid_dict.pop(future):
+                    self._cb_next(len(blockids))
+                    if not filerange:
+                        for blk in blockids:
+                            saved[blk // blocksize] = block_hash
+        finally:
+            #  Blocks in flight are written to fd, so they must be finished
+            #  before the caller can close it, even on errors or interrupts
+            window.close()
+        local_file.flush()
 
-        for thread in flying.values():
-            thread.join()
-        self._thread2file(flying, blockid_dict, local_file, offset, **restargs)
+    def _reuse_local_blocks(
+            self, hash_list, blocksize, blockhash, total_size, local_file):
+        """Hash local_file and copy every block it already contains to the
+        positions where the remote object has it. Blocks about to be
+        overwritten are stashed in a temporary file first.
+
+        :returns: (list) the hash of each block of local_file which is now
+            the same as the remote one, None for blocks to download
+        """
+        fd = local_file.fileno()
+        local_file.flush()
+        file_size = fstat(fd).st_size
+        local_file.seek(0)
+        local = [h for offset, block, h in self._hash_blocks(
+            blocksize, blockhash, file_size,
+            1 + (file_size - 1) // blocksize if file_size else 0, local_file)]
+        placed = [
+            h if (i < len(local) and local[i] == h) else None
+            for i, h in enumerate(hash_list)]
+        # Blocks already in place are never overwritten, use them as sources
+        matching = set([i for i, h in enumerate(placed) if h])
+        sources = dict()
+        for i, h in enumerate(local):
+            sources.setdefault(h, []).append(i)
+
+        def read_block(i):
+            return pread(fd, blocksize, i * blocksize).rstrip('\x00')
+
+        copies, stash, stashed = [], None, dict()
+        for i, h in enumerate(hash_list):
+            if i in matching or h not in sources:
+                continue
+            stable = [j for j in sources[h] if (
+                j in matching or j >= len(hash_list))]
+            if stable:
+                copies.append((i, stable[0], None))
+                continue
+            if h not in stashed:
+                stash = stash or TemporaryFile()
+                block = read_block(sources[h][0])
+                stash.seek(0, 2)
+                stashed[h] = (len(block), stash.tell())
+                stash.write(block)
+            copies.append((i, None, stashed[h]))
+        if stash:
+            stash.flush()
+        for i, src, stash_pos in copies:
+            block = read_block(src) if stash_pos is None else pread(
+                stash.fileno(), *stash_pos)
+            size = min(blocksize, total_size - i * blocksize)
+            pwrite(fd, block + '\x00' * (size - len(block)), i * blocksize)
+            placed[i] = hash_list[i]
+        if stash:
+            stash.close()
+        return placed
+
+    def _cache_saved_hashes(
+            self, local_file, saved, blocksize, blockhash, total_size):
+        """Store the hashes of the local_file blocks which are identical to
+        the remote ones, so that a later resume or upload does not hash them
+        """
+        local_file.flush()
+        file_size = fstat(local_file.fileno()).st_size
+        nblocks = 1 + (file_size - 1) // blocksize if file_size else 0
+        hashes = []
+        for i in xrange(nblocks):
+            end = (i + 1) * blocksize
+            same_size = min(end, file_size) == min(end, total_size)
+            hashes.append(saved.get(i) if same_size else None)
+        self.hash_cache.set(
+            local_file, 0, file_size, blocksize, blockhash, hashes)
 
     def download_object(
             self, obj, dst,
@@ -789,7 +1663,8 @@ class PithosClient(PithosRestClient):
             if_none_match=None,
             if_modified_since=None,
             if_unmodified_since=None,
-            headers=dict()):
+            headers=dict(),
+            delta=False):
         """Download an object (multiple connections, random blocks)
 
         :param obj: (str) remote object path
@@ -813,6 +1688,10 @@ class PithosClient(PithosRestClient):
         :param if_unmodified_since: (str) formated date
 
         :param headers: (dict) placeholder to gather object headers
+
+        :param delta: (bool) update an existing dst (rb+) in place: blocks
+            found anywhere in dst are copied locally, only the rest are
+            downloaded. Ignored if range_str is set
         """
         restargs = dict(
             version=version,
@@ -846,22 +1725,114 @@ class PithosClient(PithosRestClient):
                 range_str,
                 **restargs)
         else:
-            self._dump_blocks_async(
-                obj,
-                remote_hashes,
-                blocksize,
-                total_size,
-                dst,
-                blockhash,
-                resume,
-                range_str,
-                **restargs)
-            if not range_str:
-                # this should not be used in all cases
-                dst.truncate(total_size)
+            saved, local_hashes = dict(), None
+            try:
+                if delta and not range_str:
+                    local_hashes = self._reuse_local_blocks(
+                        hash_list, blocksize, blockhash, total_size, dst)
+                self._dump_blocks_async(
+                    obj,
+                    remote_hashes,
+                    blocksize,
+                    total_size,
+                    dst,
+                    blockhash,
+                    resume or local_hashes is not None,
+                    range_str,
+                    saved,
+                    local_hashes,
+                    **restargs)
+                if not range_str:
+                    # this should not be used in all cases
+                    dst.truncate(total_size)
+            finally:
+                if self.hash_cache and not range_str:
+                    self._cache_saved_hashes(
+                        dst, saved, blocksize, blockhash, total_size)
 
         self._complete_cb()
 
+    def _download_file(
+            self, obj, local_path, size=None, small_size=0, resume=False,
+            **kwargs):
+        """Download an object to a local file, with a single request if it is
+        not larger than small_size, with download_object otherwise
+        """
+        mode = 'rb+' if resume and os.path.exists(local_path) else 'wb+'
+        with open(local_path, mode) as f:
+            if size is None or size > small_size or kwargs.get('range_str'):
+                return self.download_object(
+                    obj, f, resume=resume, **kwargs)
+            r = self.object_get(
+                obj,
+                stream=True,
+                version=kwargs.get('version'),
+                if_etag_match=kwargs.get('if_match'),
+                if_etag_not_match=kwargs.get('if_none_match'),
+                if_modified_since=kwargs.get('if_modified_since'),
+                if_unmodified_since=kwargs.get('if_unmodified_since'),
+                success=(200, 304, 412))
+            try:
+                if r.status_code == 200:
+                    expected, written = _content_length(r), 0
+                    for chunk in r.iter_content():
+                        f.write(chunk)
+                        written += len(chunk)
+                    if expected is not None and written != expected:
+                        raise ClientError(
+                            'Expected %s bytes of %s, got %s' % (
+                                expected, obj, written))
+                    f.truncate()
+            finally:
+                r.close()
+
+    def download_objects(
+            self, targets, download_cb=None, max_files=None,
+            small_files=True, **kwargs):
+        """Download many objects at the same time. Each object is downloaded
+        by a client of its own, in a worker pool of files, so that hashmap
+        requests overlap with block transfers. The blocks of all objects share
+        the transfer worker pool of this client, so that MAX_THREADS bounds
+        the block transfers of all objects together. Smaller objects go first
+
+        :param targets: (list) of (remote object path, local file path, object
+            size in bytes or None if not known)
+
+        :param download_cb: optional progress.bar object for downloading,
+            which advances once per downloaded object
+
+        :param max_files: (int) how many objects to download at the same time
+            (default: MAX_THREADS)
+
+        :param small_files: (bool) download each object that fits in a block
+            with a single request, instead of through its hashmap
+
+        :param kwargs: download_object keyword arguments for all objects
+            (e.g., resume, version, if_match)
+
+        :returns: (generator) of (remote path, local path), in order of
+            completion. If an object fails, the next ones are not downloaded,
+            and the error is raised when the downloads in progress are
+            finished
+        """
+        self._assert_container()
+        small_size = int(self.get_container_info()[
+            'x-container-block-size']) if small_files else 0
+        if download_cb:
+            self.progress_bar_gen = download_cb(len(targets))
+            self._cb_next()
+
+        def jobs():
+            for obj, local_path, size in sorted(targets, key=lambda t: (
+                    t[2] is None, t[2])):
+                yield Future(
+                    self._clone()._download_file, obj, local_path,
+                    size=size, small_size=small_size, **kwargs)
+
+        for future in self._run_file_jobs(jobs(), max_files):
+            self._cb_next()
+            yield future.args[0], future.args[1]
+
     def download_to_string(
             self, obj,
             download_cb=None,
@@ -927,83 +1898,278 @@ class PithosClient(PithosRestClient):
             self.progress_bar_gen = download_cb(len(hash_list))
             self._cb_next()
 
-        num_of_blocks = len(remote_hashes)
-        ret = [''] * num_of_blocks
-        self._init_thread_limit()
-        flying = dict()
+        ret = [''] * len(hash_list)
         try:
-            for blockid, blockhash in enumerate(remote_hashes):
-                start = blocksize * blockid
-                is_last = start + blocksize > total_size
-                end = (total_size - 1) if is_last else (start + blocksize - 1)
-                data_range_str = _range_up(start, end, end, range_str)
-                if data_range_str:
-                    self._watch_thread_limit(flying.values())
-                    restargs['data_range'] = 'bytes=%s' % data_range_str
-                    flying[blockid] = self._get_block_async(obj, **restargs)
-                for runid, thread in flying.items():
-                    if (blockid + 1) == num_of_blocks:
-                        thread.join()
-                    elif thread.isAlive():
-                        continue
-                    if thread.exception:
-                        raise thread.exception
-                    ret[runid] = thread.value.content
-                    self._cb_next()
-                    flying.pop(runid)
+            for blockid, block in self._download_blocks(
+                    obj, blocksize, blockhash, total_size, hash_list,
+                    range_str, **restargs):
+                ret[blockid] = block if isinstance(
+                    block, str) else block.tobytes()
             return ''.join(ret)
         except KeyboardInterrupt:
             LOG.debug('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.shutdown_workers()
+
+    def download_to_buffer(
+            self, obj,
+            buffer_=None,
+            download_cb=None,
+            version=None,
+            range_str=None,
+            if_match=None,
+            if_none_match=None,
+            if_modified_since=None,
+            if_unmodified_since=None,
+            hashmap=None,
+            headers=dict()):
+        """Download an object in memory (multiple connections), like
+        download_to_string, but each block is streamed straight to its place
+        in a preallocated buffer, so the object is not held in memory twice.
+
+        :param obj: (str) remote object path
+
+        :param buffer_: (bytearray or writable memoryview) where to download,
+            at least as large as the (requested range of the) object. If not
+            given, a bytearray of the right size is allocated
+
+        :param download_cb: optional progress.bar object for downloading
+
+        :param version: (str) file version
+
+        :param range_str: (str) from, to are file positions (int) in bytes
+
+        :param if_match: (str)
+
+        :param if_none_match: (str)
+
+        :param if_modified_since: (str) formated date
+
+        :param if_unmodified_since: (str) formated date
+
+        :param hashmap: (dict) the remote object hashmap, if it is available
+
+        :param headers: (dict) a placeholder dict to gather object headers
+
+        :returns: (bytearray or memoryview) the buffer, with the object
+            contents (or the requested ranges, one after the other) in front
+        """
+        restargs = dict(
+            version=version,
+            data_range=None if range_str is None else 'bytes=%s' % range_str,
+            if_match=if_match,
+            if_none_match=if_none_match,
+            if_modified_since=if_modified_since,
+            if_unmodified_since=if_unmodified_since,
+            headers=dict())
+
+        (
+            blocksize,
+            blockhash,
+            total_size,
+            hash_list,
+            remote_hashes) = self._get_remote_blocks_info(
+                obj, hashmap=hashmap, **restargs)
+        headers.update(restargs.pop('headers'))
+        assert total_size >= 0
+
+        offsets, size = dict(), 0
+        for blockid, start, end, data_range in _block_ranges(
+                blocksize, total_size, len(hash_list), range_str):
+            offsets[blockid] = (size, _range_size(data_range))
+            size += offsets[blockid][1]
+        if buffer_ is None:
+            buffer_ = bytearray(size)
+        elif len(buffer_) < size:
+            raise ClientError(
+                'Buffer of %s bytes is too small for %s bytes' % (
+                    len(buffer_), size))
+
+        if download_cb:
+            self.progress_bar_gen = download_cb(len(hash_list))
+            self._cb_next()
+
+        try:
+            for blockid, block in self._download_blocks(
+                    obj, blocksize, blockhash, total_size, hash_list,
+                    range_str, into=(memoryview(buffer_), offsets),
+                    **restargs):
+                if block is None:
+                    continue
+                offset, block_size = offsets[blockid]
+                if len(block) != block_size:
+                    raise ClientError(
+                        'Expected %s bytes for block %s, got %s' % (
+                            block_size, blockid, len(block)))
+                buffer_[offset:offset + block_size] = block
+            return buffer_
+        except KeyboardInterrupt:
+            LOG.debug('- - - wait for threads to finish')
+            self.shutdown_workers()
+            raise
+
+    def _download_blocks(
+            self, obj, blocksize, blockhash, total_size, hash_list,
+            range_str=None, into=None, **restargs):
+        """Download the blocks of an object in parallel
+
+        :param into: (tuple) a writable memoryview and a dict of blockid to
+            (offset, size) in it, for the downloaded blocks to be streamed
+            straight to their place in the memoryview
+
+        :returns: (generator) of (blockid, block) in order of arrival, where
+            block is the part of the block in range_str, or None if it is
+            already read into its place
+        """
+        blockids, stored = dict(), []
+
+        def needed():
+            for blockid, start, end, data_range_str in _block_ranges(
+                    blocksize, total_size, len(hash_list), range_str):
+                if data_range_str:
+                    whole = data_range_str == '%s-%s' % (start, end)
+                    block = self.block_store.get(
+                        hash_list[blockid], end - start + 1, blockhash) if (
+                            whole and self.block_store) else None
+                    if block is None:
+                        yield start, end, whole, (blockid, data_range_str)
+                    else:
+                        stored.append((blockid, block))
+
+        def blocks():
+            for run in _block_runs(needed(), self.MAX_RANGE_BLOCKS):
+                start, end = run[0][0], run[-1][1]
+                restargs['data_range'] = 'bytes=%s' % (
+                    '%s-%s' % (start, end) if len(run) > 1 else (
+                        run[0][3][1]))
+                hashes = [hash_list[block[3][0]] for block in run] if all(
+                    [block[2] for block in run]) else None
+                if into:
+                    view, offsets = into
+                    first, (last, last_size) = offsets[run[0][3][0]][0], (
+                        offsets[run[-1][3][0]])
+                    future = Future(
+                        self._read_blocks_into, obj,
+                        view[first:last + last_size], blocksize,
+                        hashes=hashes, blockhash=blockhash,
+                        success=(200, 206), **restargs)
+                else:
+                    future = Future(
+                        self._get_blocks, obj, blocksize, len(run),
+                        hashes=hashes, blockhash=blockhash,
+                        success=(200, 206), **restargs)
+                future.size = end - start + 1
+                blockids[future] = [block[3][0] for block in run]
+                yield future
+
+        for future in self._sliding_window(blocks()):
+            while stored:
+                self._cb_next()
+                yield stored.pop()
+            if future.exception:
+                raise future.exception
+            run_blockids = blockids.pop(future)
+            for blockid, block in zip(run_blockids, future.value or (
+                    [None] * len(run_blockids))):
+                self._cb_next()
+                yield blockid, block
+        while stored:
+            self._cb_next()
+            yield stored.pop()
 
     def stream_down(self, obj, dst, buffer_blocks=4, **kwargs):
         """
-        Download obj to dst as a stream. Buffer-sized chunks are downloaded
-            sequentially, but the blocks of each chunk are downloaded
-            asynchronously, using the download_to_string method
+        Download obj to dst as a stream. Up to buffer_blocks blocks are
+            downloaded in parallel (regardless of MAX_THREADS), ahead of the
+            write position, and each block is written as soon as the blocks
+            before it are written
         :param obj: (str) the remote object
         :param dst: a file descriptor allowing sequential writing
-        :param buffer_blocks: (int) the size of the buffer in blocks. If it is
-            1, all blocks will be downloaded sequentially
+        :param buffer_blocks: (int) the size of the reorder buffer in blocks.
+            If it is 1, all blocks will be downloaded sequentially
         :param kwargs: (dict) keyword arguments for download_to_string method
         """
-        buffer_blocks = 1 if buffer_blocks < 2 else buffer_blocks
+        buffer_blocks = 4 if buffer_blocks is None else max(1, buffer_blocks)
         hashmap = kwargs.get('hashmap', None)
         range_str = kwargs.pop('range_str', None)
         if hashmap is None:
-            # Clean kwargs if it contains hashmap=None
-            kwargs.pop('hashmap', None)
-            # Get new hashmap
-            hashmap = kwargs['hashmap'] = self.get_object_hashmap(
+            hashmap = self.get_object_hashmap(
                 obj,
                 kwargs.get('version', None),
                 kwargs.get('if_match', None),
                 kwargs.get('if_none_match', None),
                 kwargs.get('if_modified_since', None),
                 kwargs.get('if_unmodified_since', None))
-        block_size, obj_size = int(hashmap['block_size']), hashmap['bytes']
-        buffer_size = buffer_blocks * block_size
-        event = None
-
-        def finish_event(e):
-            """Blocking: stop until e is finished or raise error"""
-            if e is not None:
-                if e.isAlive():
-                    e.join()
-                if e.exception:
-                    raise e.exception
-
-        for chunk_number in range(1 + obj_size // buffer_size):
-            start = chunk_number * buffer_size
-            end = start + buffer_size
-            end = (obj_size if (end > obj_size) else end) - 1
-            kwargs['range_str'] = _range_up(start, end, obj_size, range_str)
-            buffer_ = self.download_to_string(obj, **kwargs)
-            finish_event(event)
-            event = SilentEvent(_dump_buffer, buffer_, dst)
-            event.start()
-        finish_event(event)
+        blocksize, obj_size = int(hashmap['block_size']), hashmap['bytes']
+        blockhash, hash_list = hashmap['block_hash'], hashmap['hashes']
+        restargs = dict([(k, kwargs.get(k, None)) for k in (
+            'version', 'if_match', 'if_none_match', 'if_modified_since',
+            'if_unmodified_since')])
+        if kwargs.get('download_cb', None):
+            self.progress_bar_gen = kwargs['download_cb'](len(hash_list))
+            self._cb_next()
+
+        def needed():
+            for blockid, start, end, data_range in _block_ranges(
+                    blocksize, obj_size, len(hash_list), range_str):
+                if data_range:
+                    yield start, end, data_range == '%s-%s' % (
+                        start, end), blockid
+
+        def get(run):
+            """:returns: a list of blocks, or a Future to get them"""
+            start, end = run[0][0], run[-1][1]
+            whole = all([block[2] for block in run])
+            if whole and len(run) == 1 and self.block_store:
+                block = self.block_store.get(
+                    hash_list[run[0][3]], end - start + 1, blockhash)
+                if block is not None:
+                    return [block]
+            data_range = '%s-%s' % (start, end) if whole else (
+                _range_up(start, end, obj_size, range_str))
+            return pool.submit(
+                self._get_blocks, obj, blocksize, len(run),
+                hashes=[hash_list[block[3]] for block in run] if (
+                    whole) else None,
+                blockhash=blockhash,
+                data_range='bytes=%s' % data_range,
+                success=(200, 206),
+                **restargs)
+
+        pool = self._get_worker_pool('stream', buffer_blocks)
+        reorder_buffer, buffered = deque(), 0
+        runs = _block_runs(needed(), min(self.MAX_RANGE_BLOCKS, buffer_blocks))
+        try:
+            for run in runs:
+                while reorder_buffer and (
+                        buffered + len(run) > buffer_blocks):
+                    buffered -= self._write_blocks(reorder_buffer, dst)
+                reorder_buffer.append(get(run))
+                buffered += len(run)
+            while reorder_buffer:
+                self._write_blocks(reorder_buffer, dst)
+        except KeyboardInterrupt:
+            LOG.debug('- - - wait for threads to finish')
+            self.shutdown_workers()
+            raise
+        finally:
+            for pending in reorder_buffer:
+                if isinstance(pending, Future):
+                    pending.cancel()
+        dst.flush()
+
+    def _write_blocks(self, reorder_buffer, dst):
+        """Wait for the first blocks of the reorder buffer and write them
+
+        :returns: (int) the number of blocks written
+        """
+        blocks = reorder_buffer[0]
+        if isinstance(blocks, Future):
+            blocks = blocks.result()
+        reorder_buffer.popleft()
+        for block in blocks:
+            dst.write(block if isinstance(block, str) else block.tobytes())
+            self._cb_next()
+        return len(blocks)
 
     # Command Progress Bar method
     def _cb_next(self, step=1):
@@ -1409,15 +2575,14 @@ class PithosClient(PithosRestClient):
 
                 self._watch_thread_limit(flying.values())
                 unfinished = {}
-                flying[i] = SilentEvent(
-                    method=self.object_post,
+                flying[i] = self._submit(
+                    self.object_post,
                     obj=obj,
                     update=True,
                     content_range='bytes */*',
                     content_type='application/octet-stream',
                     content_length=len(block),
                     data=block)
-                flying[i].start()
 
                 for key, thread in flying.items():
                     if thread.isAlive():
@@ -1432,11 +2597,8 @@ class PithosClient(PithosRestClient):
                 flying = unfinished
         except KeyboardInterrupt:
             LOG.debug('- - - wait for threads to finish')
-            for thread in activethreads():
-                thread.join()
+            self.shutdown_workers()
         finally:
-            from time import sleep
-            sleep(2 * len(activethreads()))
             self._cb_next()
         return headers.values()
 
@@ -0,0 +1,310 @@
+# Copyright 2011-2016 GRNET S.A. All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or
+# without modification, are permitted provided that the following
+# conditions are met:
+#
+#   1. Redistributions of source code must retain the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above
+#      copyright notice, this list of conditions and the following
+#      disclaimer in the documentation and/or other materials
+#      provided with the distribution.
+#
+# THIS SOFTWARE IS PROVIDED BY GRNET S.A. ``AS IS'' AND ANY EXPRESS
+# OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR
+# PURPOSE ARE DISCLAIMED. IN NO EVENT SHALL GRNET S.A OR
+# CONTRIBUTORS BE LIABLE FOR ANY DIRECT, INDIRECT, INCIDENTAL,
+# SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT NOT
+# LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF
+# USE, DATA, OR PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED
+# AND ON ANY THEORY OF LIABILITY, WHETHER IN CONTRACT, STRICT
+# LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE) ARISING IN
+# ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+#
+# The views and conclusions contained in the software and
+# documentation are those of the authors and should not be
+# interpreted as representing official policies, either expressed
+# or implied, of GRNET S.A.
+
+import os
+from hashlib import sha1, new as newhashlib
+from json import dumps, loads
+from logging import getLogger
+
+LOG = getLogger(__name__)
+
+
+def _file_identity(fileobj):
+    """:returns: (tuple) path, inode, size and modification time of an open
+        file, or None if it is not a regular file on disk
+    """
+    try:
+        st = os.fstat(fileobj.fileno())
+        return (
+            os.path.abspath(fileobj.name), st.st_ino, st.st_size,
+            repr(st.st_mtime))
+    except (AttributeError, TypeError, ValueError, IOError, OSError):
+        return None
+
+
+class HashCache(object):
+    """Persistent cache of the block hashes of local files
+
+    Each entry is a json file in the cache directory, named after the file
+    identity (path, inode, size, modification time), the hashed data range
+    and the container block size and hash algorithm. A changed file gets a
+    new identity, so stale entries are never matched, just evicted (least
+    recently used first) when the cache grows over max_entries.
+    """
+
+    def __init__(self, path, max_entries=1000):
+        """
+        :param path: (str) the cache directory, created if missing
+
+        :param max_entries: (int) number of files to remember
+        """
+        self.path = os.path.expanduser(path)
+        self.max_entries = max_entries
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as err:
+                LOG.debug('Hash cache is not available: %s' % err)
+
+    def _entry(self, fileobj, offset, size, blocksize, blockhash):
+        identity = _file_identity(fileobj)
+        if identity is None:
+            return None
+        key = '%s' % ((identity, offset, size, blocksize, blockhash), )
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    def get(self, fileobj, offset, size, blocksize, blockhash):
+        """:returns: (list) the hash of each block of fileobj[offset:size] in
+            order, with None for unknown blocks, or None on cache miss
+        """
+        entry = self._entry(fileobj, offset, size, blocksize, blockhash)
+        if entry is None:
+            return None
+        try:
+            with open(entry) as f:
+                hashes = loads(f.read())['hashes']
+            os.utime(entry, None)
+            return hashes
+        except (IOError, OSError, ValueError, KeyError) as err:
+            if os.path.exists(entry):
+                LOG.debug('Invalid hash cache entry %s: %s' % (entry, err))
+            return None
+
+    def set(self, fileobj, offset, size, blocksize, blockhash, hashes):
+        """Store the block hashes of fileobj[offset:size], as they are now
+
+        :param hashes: (list) block hashes in order, None for unknown blocks
+        """
+        entry = self._entry(fileobj, offset, size, blocksize, blockhash)
+        if entry is None:
+            return
+        tmp = '%s.%s.tmp' % (entry, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write(dumps(dict(hashes=hashes)))
+            os.rename(tmp, entry)
+            self._evict()
+        except (IOError, OSError) as err:
+            LOG.debug('Failed to update hash cache %s: %s' % (entry, err))
+
+    def _evict(self):
+        entries = []
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            try:
+                entries.append((os.path.getmtime(entry), entry))
+            except OSError:
+                continue
+        entries.sort()
+        for mtime, entry in entries[:max(0, len(entries) - self.max_entries)]:
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+
+
+class UploadJournal(object):
+    """Persistent journal of uploads, so that interrupted ones can resume
+
+    Each entry is a file in the journal directory, named after the file
+    identity (see HashCache) and the upload target (e.g., account,
+    container, object path, container block size and hash algorithm). The
+    first line is the list of block hashes of the file, in json. Each next
+    line is the hash of a block confirmed to be on the server, appended as
+    soon as it is uploaded, so an interrupted upload loses nothing but the
+    blocks in flight. Entries are removed when the upload is completed.
+    """
+
+    def __init__(self, path):
+        """:param path: (str) the journal directory, created if missing"""
+        self.path = os.path.expanduser(path)
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as err:
+                LOG.debug('Upload journal is not available: %s' % err)
+
+    def _entry(self, fileobj, target):
+        identity = _file_identity(fileobj)
+        if identity is None:
+            return None
+        key = '%s' % ((identity, target), )
+        if isinstance(key, unicode):
+            key = key.encode('utf-8')
+        return os.path.join(self.path, sha1(key).hexdigest())
+
+    def get(self, fileobj, target):
+        """:returns: (tuple) the block hashes of fileobj and the set of the
+            confirmed ones, or None if there is no journal of this upload
+        """
+        entry = self._entry(fileobj, target)
+        if entry is None:
+            return None
+        try:
+            with open(entry) as f:
+                lines = f.read().split('\n')
+            hashes = loads(lines[0])
+        except (IOError, OSError, ValueError) as err:
+            if os.path.exists(entry):
+                LOG.debug('Invalid upload journal %s: %s' % (entry, err))
+            return None
+        #  The last line may be partially written, if it is not terminated
+        return hashes, set(lines[1:-1]).intersection(hashes)
+
+    def start(self, fileobj, target, hashes):
+        """Start the journal of an upload, replacing any older one
+
+        :param hashes: (list) the block hashes of fileobj, in order
+        """
+        entry = self._entry(fileobj, target)
+        if entry is None:
+            return
+        tmp = '%s.%s.tmp' % (entry, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                f.write('%s\n' % dumps(hashes))
+            os.rename(tmp, entry)
+        except (IOError, OSError) as err:
+            LOG.debug('Failed to start upload journal %s: %s' % (entry, err))
+
+    def confirm(self, fileobj, target, hashes):
+        """Record that some blocks of an upload are on the server
+
+        :param hashes: (list) block hashes
+        """
+        entry = self._entry(fileobj, target)
+        if entry is None or not os.path.exists(entry):
+            return
+        try:
+            with open(entry, 'a') as f:
+                f.write(''.join(['%s\n' % h for h in hashes]))
+        except (IOError, OSError) as err:
+            LOG.debug('Failed to update upload journal %s: %s' % (entry, err))
+
+    def remove(self, fileobj, target):
+        """Forget a completed upload"""
+        entry = self._entry(fileobj, target)
+        if entry is None:
+            return
+        try:
+            os.remove(entry)
+        except OSError:
+            pass
+
+
+class BlockStore(object):
+    """Content addressed store of Pithos+ blocks, shared by all downloads
+
+    Each block is a file named after the block hash, stored without the
+    trailing zeros that Pithos+ ignores when hashing. A block is verified
+    against its hash when it is read. The least recently used blocks are
+    evicted when the store grows over max_size bytes.
+    """
+
+    def __init__(self, path, max_size=1024 * 1024 * 1024):
+        """
+        :param path: (str) the store directory, created if missing
+
+        :param max_size: (int) maximum bytes of blocks to keep
+        """
+        self.path = os.path.expanduser(path)
+        self.max_size = max_size
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError as err:
+                LOG.debug('Block store is not available: %s' % err)
+
+    def _entry(self, block_hash, blockhash):
+        return os.path.join(self.path, '%s-%s' % (blockhash, block_hash))
+
+    def get(self, block_hash, size, blockhash):
+        """:returns: (str) the block of size bytes, or None if missing"""
+        entry = self._entry(block_hash, blockhash)
+        try:
+            with open(entry, 'rb') as f:
+                data = f.read()
+        except (IOError, OSError):
+            return None
+        h = newhashlib(blockhash)
+        h.update(data)
+        if len(data) > size or h.hexdigest() != block_hash:
+            LOG.debug('Invalid block %s, removing it' % entry)
+            try:
+                os.remove(entry)
+            except OSError:
+                pass
+            return None
+        try:
+            os.utime(entry, None)
+        except OSError:
+            pass
+        return data + '\x00' * (size - len(data))
+
+    def put(self, block_hash, block, blockhash):
+        """Store a block, unless it is already stored"""
+        entry = self._entry(block_hash, blockhash)
+        if os.path.exists(entry):
+            return
+        if not isinstance(block, basestring):
+            block = block.tobytes()
+        tmp = '%s.%s.%s.tmp' % (entry, os.getpid(), id(block))
+        try:
+            with open(tmp, 'wb') as f:
+                f.write(block.rstrip('\x00'))
+            os.rename(tmp, entry)
+            self._evict()
+        except (IOError, OSError) as err:
+            LOG.debug('Failed to store block %s: %s' % (entry, err))
+
+    def _evict(self):
+        entries, total = [], 0
+        for name in os.listdir(self.path):
+            entry = os.path.join(self.path, name)
+            try:
+                st = os.stat(entry)
+            except OSError:
+                continue
+            entries.append((st.st_mtime, st.st_size, entry))
+            total += st.st_size
+        entries.sort()
+        for mtime, size, entry in entries:
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(entry)
+                total -= size
+            except OSError:
+                pass
@@ -33,10 +33,12 @@
 
 from unittest import TestCase
 from mock import patch, call
-from tempfile import NamedTemporaryFile
-from os import urandom
+from tempfile import NamedTemporaryFile, mkdtemp
+from shutil import rmtree
+from os import urandom, listdir
 from itertools import product
 from random import randint
+from time import sleep
 
 from kamaki.clients import pithos, ClientError
 
@@ -149,6 +151,28 @@ class FR(object):
     content = json
     status = None
     status_code = 200
+    chunk_size = 3
+
+    def read(self, amt=None):
+        start = getattr(self, '_read', 0)
+        end = len(self.content) if amt is None else start + amt
+        self._read = min(end, len(self.content))
+        return self.content[start:end]
+
+    def iter_content(self, chunk_size=None):
+        chunk_size = chunk_size or self.chunk_size
+        chunk = self.read(chunk_size)
+        while chunk:
+            yield chunk
+            chunk = self.read(chunk_size)
+
+    def readinto(self, buffer_):
+        data = self.read(len(buffer_))
+        memoryview(buffer_)[:len(data)] = data
+        return len(data)
+
+    def close(self):
+        pass
 
 
 class PithosRestClient(TestCase):
@@ -769,6 +793,200 @@ class PithosMethods(TestCase):
                 ((42, 333, 800, '100,50-200,-600',), '42-100,50-200,200-333')):
             self.assertEqual(_range_up(*args), expected)
 
+    def test__block_runs(self):
+        from kamaki.clients.pithos import _block_runs
+        blocks = [
+            (0, 3, True, 'a'), (4, 7, True, 'b'), (8, 11, True, 'c'),
+            (16, 19, True, 'd'), (20, 21, False, 'e'), (24, 27, True, 'f')]
+        for max_blocks, exp in (
+                (1, ['a', 'b', 'c', 'd', 'e', 'f']),
+                (2, ['ab', 'c', 'd', 'e', 'f']),
+                (5, ['abc', 'd', 'e', 'f'])):
+            self.assertEqual([''.join([b[3] for b in run]) for run in (
+                _block_runs(blocks, max_blocks))], exp)
+
+    def test__pithos_hash(self):
+        from hashlib import sha256
+        from kamaki.clients.pithos import _pithos_hash
+        for data in ('s0m3 d@t@', 's0m3 d@t@\x00\x00', '\x00s0m3 d@t@'):
+            exp = sha256(data.rstrip('\x00')).hexdigest()
+            self.assertEqual(_pithos_hash(data, 'sha256'), exp)
+            self.assertEqual(
+                _pithos_hash(memoryview(data), 'sha256'), exp)
+        self.assertEqual(_pithos_hash('', 'sha256'), sha256('').hexdigest())
+
+    def test__pwrite(self):
+        from threading import Thread
+        from kamaki.clients.utils import pwrite as _pwrite, pread as _pread
+        from kamaki.clients.pithos import _preallocate
+        with NamedTemporaryFile() as f:
+            fd = f.fileno()
+            _preallocate(fd, 4 * 26)
+            self.assertEqual(_pread(fd, 200, 0), '\x00' * 4 * 26)
+            threads = [Thread(target=_pwrite, args=(
+                fd, chr(ord('a') + i) * 4, 4 * i)) for i in range(26)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            self.assertEqual(
+                _pread(fd, 200, 0),
+                ''.join([chr(ord('a') + i) * 4 for i in range(26)]))
+            self.assertEqual(_pread(fd, 8, 6), 'bbccccdd')
+            _preallocate(fd, 10)
+            self.assertEqual(len(_pread(fd, 200, 0)), 4 * 26)
+
+    def test__data_ranges(self):
+        from StringIO import StringIO
+        from kamaki.clients.pithos import _data_ranges, _in_hole
+        with NamedTemporaryFile() as f:
+            f.write('a' * 4096)
+            f.seek(8 * 4096)
+            f.write('b' * 4096)
+            f.truncate(16 * 4096)
+            f.flush()
+            ranges = _data_ranges(f, 0, 16 * 4096)
+            self.assertEqual(f.tell(), 9 * 4096)
+            if ranges is None:
+                #  the file system does not report holes
+                return
+            self.assertEqual(ranges, [(0, 4096), (8 * 4096, 9 * 4096)])
+            self.assertEqual(_data_ranges(f, 0, 4096), None)
+            self.assertEqual(_data_ranges(f, 4096, 4096), [])
+            for offset, size, exp in (
+                    (0, 4096, False), (4096, 4096, True),
+                    (4096, 4 * 4096, True), (4 * 4096, 5 * 4096, False),
+                    (9 * 4096, 4096, True)):
+                self.assertEqual(_in_hole(ranges, offset, size), exp)
+            self.assertEqual(ranges, [])
+        self.assertEqual(_data_ranges(StringIO('s0m3 d@t@'), 0, 9), None)
+
+    def test__map_file(self):
+        from StringIO import StringIO
+        from kamaki.clients.pithos import _map_file, _mapped_block
+        with NamedTemporaryFile() as f:
+            self.assertEqual(_map_file(f), None)
+            f.write('s0m3 d@t@')
+            f.flush()
+            fmap = _map_file(f)
+            self.assertEqual(_mapped_block(fmap, 2, 4).tobytes(), 'm3 d')
+            self.assertEqual(_mapped_block(fmap, 5, 10).tobytes(), 'd@t@')
+        self.assertEqual(_map_file(StringIO('s0m3 d@t@')), None)
+
+
+class HashCache(TestCase):
+
+    def setUp(self):
+        from kamaki.clients.pithos.cache import HashCache
+        self.path = mkdtemp()
+        self.cache = HashCache(self.path, max_entries=2)
+        self.files = [NamedTemporaryFile() for i in range(3)]
+        for f in self.files:
+            f.write('s0m3 d@t@')
+            f.flush()
+
+    def tearDown(self):
+        for f in self.files:
+            f.close()
+        rmtree(self.path)
+
+    def test_get_set(self):
+        f = self.files[0]
+        args = (f, 0, 9, 4, 'sha256')
+        self.assertEqual(self.cache.get(*args), None)
+        self.cache.set(*(args + (['h1', None, 'h3'], )))
+        self.assertEqual(self.cache.get(*args), ['h1', None, 'h3'])
+        for other in ((f, 1, 8, 4, 'sha256'), (f, 0, 9, 8, 'sha256'), (
+                f, 0, 9, 4, 'sha1'), (self.files[1], 0, 9, 4, 'sha256')):
+            self.assertEqual(self.cache.get(*other), None)
+        f.seek(0, 2)
+        f.write('more data')
+        f.flush()
+        self.assertEqual(self.cache.get(*args), None)
+
+    def test_evict(self):
+        for i, f in enumerate(self.files):
+            self.cache.set(f, 0, 9, 4, 'sha256', ['h%s' % i])
+            sleep(0.01)
+            self.assertEqual(len(listdir(self.path)), min(i + 1, 2))
+        self.assertEqual(
+            self.cache.get(self.files[0], 0, 9, 4, 'sha256'), None)
+        self.assertEqual(
+            self.cache.get(self.files[2], 0, 9, 4, 'sha256'), ['h2'])
+
+
+class UploadJournal(TestCase):
+
+    def setUp(self):
+        from kamaki.clients.pithos.cache import UploadJournal
+        self.path = mkdtemp()
+        self.journal = UploadJournal(self.path)
+        self.file = NamedTemporaryFile()
+        self.file.write('s0m3 d@t@')
+        self.file.flush()
+
+    def tearDown(self):
+        self.file.close()
+        rmtree(self.path)
+
+    def test_journal(self):
+        f, target = self.file, ('account', 'container', 'obj', 4, 'sha256')
+        self.assertEqual(self.journal.get(f, target), None)
+        self.journal.confirm(f, target, ['h1'])
+        self.assertEqual(listdir(self.path), [])
+        self.journal.start(f, target, ['h1', 'h2', 'h3'])
+        self.assertEqual(self.journal.get(f, target), (
+            ['h1', 'h2', 'h3'], set()))
+        self.journal.confirm(f, target, ['h1'])
+        self.journal.confirm(f, target, ['h3', 'other'])
+        self.assertEqual(self.journal.get(f, target), (
+            ['h1', 'h2', 'h3'], set(['h1', 'h3'])))
+        self.assertEqual(self.journal.get(f, target[:-1] + ('sha1', )), None)
+
+        #  An interrupted write is ignored
+        with open(self.journal._entry(f, target), 'a') as jf:
+            jf.write('h2')
+        self.assertEqual(self.journal.get(f, target)[1], set(['h1', 'h3']))
+
+        self.journal.start(f, target, ['h1', 'h2', 'h3'])
+        self.assertEqual(self.journal.get(f, target)[1], set())
+        self.journal.remove(f, target)
+        self.assertEqual(self.journal.get(f, target), None)
+        self.assertEqual(listdir(self.path), [])
+
+
+class BlockStore(TestCase):
+
+    def setUp(self):
+        from kamaki.clients.pithos.cache import BlockStore
+        self.path = mkdtemp()
+        self.store = BlockStore(self.path, max_size=10)
+
+    def tearDown(self):
+        rmtree(self.path)
+
+    def test_get_put(self):
+        from kamaki.clients.pithos import _pithos_hash
+        h = _pithos_hash('s0m3\x00', 'sha256')
+        self.assertEqual(self.store.get(h, 5, 'sha256'), None)
+        self.store.put(h, memoryview('s0m3\x00'), 'sha256')
+        self.assertEqual(self.store.get(h, 5, 'sha256'), 's0m3\x00')
+        self.assertEqual(self.store.get(h, 7, 'sha256'), 's0m3\x00\x00\x00')
+        self.assertEqual(self.store.get(h, 3, 'sha256'), None)
+        self.assertEqual(self.store.get(h, 5, 'sha1'), None)
+
+        with open(self.store._entry(h, 'sha256'), 'w') as f:
+            f.write('corrupted')
+        self.assertEqual(self.store.get(h, 9, 'sha256'), None)
+        self.assertEqual(listdir(self.path), [])
+
+    def test_evict(self):
+        for i in range(4):
+            self.store.put('h%s' % i, 'b%s%s%s' % (i, i, i), 'sha256')
+            sleep(0.01)
+        self.assertEqual(sorted(listdir(self.path)), [
+            'sha256-h2', 'sha256-h3'])
+
 
 class PithosClient(TestCase):
 
@@ -793,6 +1011,28 @@ class PithosClient(TestCase):
             else:
                 self.assertEqual(unicode(v), unicode(d2[k]))
 
+    def _fake_object_get(self, data, block_size=4):
+        """:returns: an object_get side effect, which returns the hashmap of
+            data or the bytes in the Range of a request
+        """
+        hashes = [pithos._pithos_hash(
+            data[i:i + block_size], 'sha256') for i in range(
+                0, len(data), block_size)]
+
+        def get(obj, data_range=None, async_headers={}, **kwargs):
+            r = FR()
+            if kwargs.get('hashmap'):
+                r.json = dict(
+                    block_hash='sha256', block_size=block_size,
+                    bytes=len(data), hashes=hashes)
+                return r
+            rng = async_headers.get('Range', data_range)
+            start, end = rng.split('=')[1].split('-')
+            r.content = data[int(start):int(end) + 1]
+            return r
+
+        return get
+
     def setUp(self):
         self.url = 'https://www.example.com/pithos'
         self.token = 'p17h0570k3n'
@@ -807,6 +1047,7 @@ class PithosClient(TestCase):
         FR.content = FR.json
         for f in self.files:
             f.close()
+        self.client.shutdown_workers()
 
     #  Pithos+ methods that extend storage API
 
@@ -846,6 +1087,245 @@ class PithosClient(TestCase):
         for i in range(len(r)):
             self.assert_dicts_are_equal(r[i], container_list[i])
 
+    def test__calculate_blocks_for_upload(self):
+        num_of_blocks, blocksize = 5, 4 * 1024 * 1024
+        tmpFile = self._create_temp_file(num_of_blocks)
+        tmpFile.seek(0, 2)
+        tmpFile.write('some more data')
+        tmpFile.flush()
+        size = num_of_blocks * blocksize + len('some more data')
+        tmpFile.seek(0)
+        exp_hashes = [pithos._pithos_hash(
+            tmpFile.read(blocksize), 'sha256') for i in range(6)]
+        for threads in (1, 2, 4):
+            self.client.HASH_THREADS = threads
+            tmpFile.seek(0)
+            hashes, hmap = [], {}
+            self.client._calculate_blocks_for_upload(
+                blocksize, 'sha256', size, 6, hashes, hmap, tmpFile)
+            self.assertEqual(hashes, exp_hashes)
+            for i, h in enumerate(hashes):
+                self.assertEqual(hmap[h], (
+                    i * blocksize, min(blocksize, size - i * blocksize)))
+
+        from kamaki.clients.pithos.cache import HashCache
+        cache_dir = mkdtemp()
+        try:
+            self.client.hash_cache = HashCache(cache_dir)
+            for i in range(2):
+                tmpFile.seek(0)
+                with patch.object(
+                        pithos, '_pithos_hash',
+                        side_effect=pithos._pithos_hash) as PH:
+                    hashes, hmap = [], {}
+                    self.client._calculate_blocks_for_upload(
+                        blocksize, 'sha256', size, 6, hashes, hmap, tmpFile)
+                    self.assertEqual(hashes, exp_hashes)
+                    self.assertEqual(len(PH.mock_calls), 0 if i else 6)
+        finally:
+            self.client.hash_cache = None
+            rmtree(cache_dir)
+
+    def test__calculate_blocks_for_upload_sparse(self):
+        blocksize = 4 * 4096
+        with NamedTemporaryFile() as f:
+            f.write('a' * 4096)
+            f.seek(3 * blocksize)
+            f.write('b' * 4096)
+            f.truncate(5 * blocksize)
+            f.flush()
+            f.seek(0)
+            data = f.read()
+            f.seek(0)
+            exp_hashes = [pithos._pithos_hash(
+                data[i:i + blocksize], 'sha256') for i in range(
+                    0, len(data), blocksize)]
+            holes = pithos._data_ranges(f, 0, len(data)) is not None
+            with patch.object(
+                    pithos, '_pithos_hash',
+                    side_effect=pithos._pithos_hash) as PH:
+                hashes, hmap = [], {}
+                self.client._calculate_blocks_for_upload(
+                    blocksize, 'sha256', len(data), 5, hashes, hmap, f)
+            self.assertEqual(hashes, exp_hashes)
+            self.assertEqual(f.tell(), len(data))
+            #  the blocks in holes share a single hash of zeros
+            self.assertEqual(len(PH.mock_calls), 3 if holes else 5)
+
+    @patch('%s._put_block' % pithos_pkg)
+    def test_upload_buffered_blocks(self, PB):
+        from StringIO import StringIO
+        from collections import OrderedDict
+        blocksize, data = 4, 'b0b1b2b3b4b5b6'
+        exp_hashes = [pithos._pithos_hash(
+            data[i:i + blocksize], 'sha256') for i in range(0, 14, blocksize)]
+        self.client.UPLOAD_BUFFER_SIZE = 8
+        fileobj = StringIO(data)
+        hashes, hmap, buffered = [], {}, OrderedDict()
+        self.client._calculate_blocks_for_upload(
+            blocksize, 'sha256', 14, 4, hashes, hmap, fileobj,
+            buffered=buffered)
+        self.assertEqual(hashes, exp_hashes)
+        self.assertEqual(buffered.keys(), exp_hashes[2:])
+        self.assertEqual(buffered.values(), ['b4b5', 'b6'])
+
+        with patch.object(fileobj, 'read', side_effect=fileobj.read) as R:
+            self.assertEqual(self.client._upload_missing_blocks(
+                exp_hashes[1:], hmap, fileobj, buffered=buffered), [])
+            self.assertEqual(R.mock_calls, [call(4)])
+        self.assertEqual(sorted(PB.mock_calls), sorted([
+            call(data='b2b3', hash=exp_hashes[1]),
+            call(data='b4b5', hash=exp_hashes[2]),
+            call(data='b6', hash=exp_hashes[3])]))
+        self.assertEqual(buffered, {})
+
+    def test__cache_saved_hashes(self):
+        from kamaki.clients.pithos.cache import HashCache
+        cache_dir = mkdtemp()
+        try:
+            self.client.hash_cache = HashCache(cache_dir)
+            self.files.append(NamedTemporaryFile())
+            tmpFile = self.files[-1]
+            tmpFile.write('1234567')
+            saved = {0: 'h0', 1: 'h1'}
+            for total_size, exp in (
+                    (7, ['h0', 'h1']), (10, ['h0', None]), (3, [None, None])):
+                self.client._cache_saved_hashes(
+                    tmpFile, saved, 4, 'sha256', total_size)
+                self.assertEqual(
+                    self.client.hash_cache.get(tmpFile, 0, 7, 4, 'sha256'),
+                    exp)
+        finally:
+            self.client.hash_cache = None
+            rmtree(cache_dir)
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=dict(
+        container_info, **{'x-container-block-size': 4}))
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_from_stream(self, OP, PB, GCI):
+        from os import pipe, fdopen
+        from threading import Thread
+        data = 'aaaabbbbaaaacc'
+        hashes = [pithos._pithos_hash(data[i:i + 4], 'sha256') for i in (
+            0, 4, 8, 12)]
+        failed = []
+
+        def put_block(data, hash):
+            if hash == hashes[1] and not failed:
+                failed.append(hash)
+                raise ClientError('failed once', 500)
+
+        PB.side_effect = put_block
+        rfd, wfd = pipe()
+        src, dst = fdopen(rfd, 'rb'), fdopen(wfd, 'wb')
+
+        def write():
+            for c in data:
+                dst.write(c)
+                dst.flush()
+            dst.close()
+
+        writer = Thread(target=write)
+        writer.start()
+        confirmed = set()
+        self.client.upload_object(
+            obj, src, content_type='some/type', confirmed=confirmed)
+        writer.join()
+        src.close()
+        self.assertEqual(sorted([c[2]['hash'] for c in PB.mock_calls]), sorted(
+            [hashes[0], hashes[1], hashes[1], hashes[3]]))
+        self.assertEqual(confirmed, set(hashes))
+        self.assertEqual(OP.mock_calls[-1][2]['json'], dict(
+            bytes=len(data), hashes=hashes))
+        self.assertEqual(OP.mock_calls[-1][2]['content_type'], 'some/type')
+
+        from StringIO import StringIO
+        PB.reset_mock()
+        self.client.upload_from_stream(
+            obj, StringIO(data), confirmed=confirmed)
+        self.assertFalse(PB.called)
+        self.assertEqual(OP.mock_calls[-1][2]['json'], dict(
+            bytes=len(data), hashes=hashes))
+        self.client.upload_from_stream(obj, StringIO(''))
+        self.assertEqual(OP.mock_calls[-1][2]['json'], dict(
+            bytes=0, hashes=[]))
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=dict(
+        container_info, **{'x-container-block-size': 4}))
+    @patch('%s._create_object_or_get_missing_hashes' % pithos_pkg)
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_object_confirmed(self, OP, PB, COGMH, GCI):
+        hashes = [pithos._pithos_hash(b, 'sha256') for b in (
+            'aaaa', 'bbbb', 'cccc')]
+        COGMH.side_effect = lambda obj, hashmap, **kwargs: (
+            list(hashmap['hashes']), dict())
+        with NamedTemporaryFile() as f:
+            f.write('aaaabbbbccccaaaa')
+            f.flush()
+            for pipelined in (False, True):
+                PB.reset_mock()
+                confirmed = set(hashes[1:2])
+                f.seek(0)
+                self.client.upload_object(
+                    obj, f, pipelined=pipelined, confirmed=confirmed)
+                self.assertEqual(sorted([
+                    c[2]['hash'] for c in PB.mock_calls]), sorted([
+                        hashes[0], hashes[2]]))
+                self.assertEqual(confirmed, set(hashes))
+
+                PB.reset_mock()
+                f.seek(0)
+                self.client.upload_object(
+                    obj, f, pipelined=pipelined, confirmed=confirmed)
+                self.assertFalse(PB.called)
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=dict(
+        container_info, **{'x-container-block-size': 4}))
+    @patch('%s._create_object_or_get_missing_hashes' % pithos_pkg)
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_object_resume(self, OP, PB, COGMH, GCI):
+        from kamaki.clients.pithos.cache import UploadJournal
+        hashes = [pithos._pithos_hash(b, 'sha256') for b in (
+            'aaaa', 'bbbb', 'cccc')]
+        COGMH.side_effect = lambda obj, hashmap, **kwargs: (
+            list(hashmap['hashes']), dict())
+
+        def put_block(data, hash):
+            if hash == hashes[2]:
+                raise ClientError('Connection lost', 503)
+
+        journal_dir = mkdtemp()
+        self.client.upload_journal = UploadJournal(journal_dir)
+        try:
+            with NamedTemporaryFile() as f:
+                f.write('aaaabbbbccccaaaa')
+                f.flush()
+                PB.side_effect = put_block
+                f.seek(0)
+                self.assertRaises(
+                    ClientError, self.client.upload_object, obj, f)
+                self.client.shutdown_workers()
+                self.assertEqual(len(listdir(journal_dir)), 1)
+
+                PB.reset_mock()
+                PB.side_effect = None
+                f.seek(0)
+                with patch.object(pithos, '_pithos_hash') as PH:
+                    self.client.upload_object(obj, f, resume=True)
+                self.assertFalse(PH.called)
+                self.assertEqual([
+                    c[2]['hash'] for c in PB.mock_calls], hashes[2:])
+                self.assertEqual(
+                    OP.mock_calls[-1][2]['json']['hashes'],
+                    hashes + hashes[:1])
+                self.assertEqual(listdir(journal_dir), [])
+        finally:
+            self.client.upload_journal = None
+            rmtree(journal_dir)
+
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
     @patch('%s.container_post' % pithos_pkg, return_value=FR())
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
@@ -970,6 +1450,38 @@ class PithosClient(TestCase):
         self.assertEqual(OP.mock_calls[-1][2]['if_etag_not_match'], '*')
         self.assertEqual(OP.mock_calls[-1][2]['etag'], etag)
 
+    @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
+    @patch('%s._put_block' % pithos_pkg)
+    @patch('%s.object_put' % pithos_pkg, return_value=FR())
+    def test_upload_object_pipelined(self, OP, PB, GCI):
+        num_of_blocks = 4
+        tmpFile = self._create_temp_file(num_of_blocks)
+        tmpFile.seek(0)
+        exp_hashes = [pithos._pithos_hash(
+            tmpFile.read(4 * 1024 * 1024), 'sha256') for i in range(4)]
+        tmpFile.seek(0)
+        FR.status_code = 201
+        try:
+            self.client.upload_object(obj, tmpFile, pipelined=True)
+        finally:
+            FR.status_code = 200
+        self.assertEqual(
+            sorted([c[2]['hash'] for c in PB.mock_calls]), sorted(exp_hashes))
+        self.assertEqual(len(OP.mock_calls), 1)
+        self.assertEqual(OP.mock_calls[-1][2]['json'], dict(
+            bytes=num_of_blocks * 4 * 1024 * 1024, hashes=exp_hashes))
+        self.assertEqual(OP.mock_calls[-1][2]['success'], (201, 409))
+
+        #  Failed uploads are sent again, when reported missing
+        PB.reset_mock()
+        PB.side_effect = [ClientError('failed', 502)] + [None] * 4
+        FR.json = exp_hashes[:1]
+        tmpFile.seek(0)
+        self.client.upload_object(obj, tmpFile, pipelined=True)
+        self.assertEqual(len(PB.mock_calls), num_of_blocks + 1)
+        self.assertEqual(PB.mock_calls[-1][2]['hash'], exp_hashes[0])
+        self.assertEqual(OP.mock_calls[-1][2]['success'], 201)
+
     @patch('%s.get_container_info' % pithos_pkg, return_value=container_info)
     @patch('%s.container_post' % pithos_pkg, return_value=FR())
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
@@ -1226,6 +1738,80 @@ class PithosClient(TestCase):
         self.client.purge_container('another-container')
         self.assertEqual(self.client.container, cont)
 
+    @patch('%s.get_container_info' % pithos_pkg, return_value=dict(
+        container_info, **{'x-container-block-size': 4}))
+    @patch('%s.upload_object' % pithos_pkg)
+    @patch('%s.upload_object_unchunked' % pithos_pkg)
+    def test_upload_objects(self, unchunked, upload, GCI):
+        from threading import Lock
+        lock, flying = Lock(), []
+
+        def uploaded(obj, f, **kwargs):
+            with lock:
+                flying.append(obj)
+                self.assertTrue(len(flying) <= 2)
+            sleep(0.01 * randint(0, 2))
+            with lock:
+                flying.remove(obj)
+            return dict(name=obj, data=f.read(), **kwargs)
+
+        unchunked.side_effect = upload.side_effect = uploaded
+        tmp_dir = mkdtemp()
+        try:
+            sources = []
+            for i, data in enumerate(('abc', 'abcdefg', '', 'abcd', 'a' * 9)):
+                local_path = '%s/f%s' % (tmp_dir, i)
+                with open(local_path, 'w') as f:
+                    f.write(data)
+                sources.append((local_path, 'o%s' % i, dict(
+                    content_type='type/%s' % i)))
+            results = dict([(obj, (lpath, r)) for lpath, obj, r in (
+                self.client.upload_objects(sources, max_files=2))])
+            self.assertEqual(sorted(results), ['o0', 'o1', 'o2', 'o3', 'o4'])
+            for local_path, obj, params in sources:
+                lpath, r = results[obj]
+                self.assertEqual(lpath, local_path)
+                self.assertEqual(r['content_type'], params['content_type'])
+                self.assertEqual(r['data'], open(local_path).read())
+            self.assertEqual(sorted([
+                c[1][0] for c in unchunked.mock_calls]), ['o0', 'o2', 'o3'])
+            self.assertEqual(sorted([
+                c[1][0] for c in upload.mock_calls]), ['o1', 'o4'])
+            self.assertEqual(len(GCI.mock_calls), 1)
+
+            upload.reset_mock()
+            unchunked.reset_mock()
+            list(self.client.upload_objects(
+                [sources[0], (sources[0][0], 'copy', dict())], max_files=1))
+            self.assertEqual([c[1][0] for c in unchunked.mock_calls], ['o0'])
+            self.assertEqual([c[1][0] for c in upload.mock_calls], ['copy'])
+
+            upload.reset_mock()
+            list(self.client.upload_objects(sources[:2], small_files=False))
+            self.assertEqual(sorted([
+                c[1][0] for c in upload.mock_calls]), ['o0', 'o1'])
+
+            upload.side_effect = ClientError('failed', 500)
+            self.assertRaises(ClientError, list, self.client.upload_objects(
+                sources[1:2]))
+
+            #  A failure is raised when the other uploads are finished
+            def slow_upload(obj, f, **kwargs):
+                if obj == 'o1':
+                    raise ClientError('failed', 500)
+                with lock:
+                    flying.append(obj)
+                sleep(0.1)
+                with lock:
+                    flying.remove(obj)
+
+            upload.side_effect = slow_upload
+            self.assertRaises(ClientError, list, self.client.upload_objects(
+                sources[1:5], max_files=2, small_files=False))
+            self.assertEqual(flying, [])
+        finally:
+            rmtree(tmp_dir)
+
     @patch('%s.object_put' % pithos_pkg, return_value=FR())
     def test_upload_object_unchunked(self, put):
         num_of_blocks = 8
@@ -1242,6 +1828,9 @@ class PithosClient(TestCase):
         r = self.client.upload_object_unchunked(obj, tmpFile)
         self.assert_dicts_are_equal(r, FR.headers)
         self.assertEqual(put.mock_calls[-1][1], (obj,))
+        self.assertTrue(isinstance(
+            put.mock_calls[-1][2]['data'], pithos.FileSlice))
+        self.assertEqual(tmpFile.tell(), expected['data'])
         self.assertEqual(
             sorted(put.mock_calls[-1][2].keys()),
             sorted(expected.keys()))
@@ -1285,6 +1874,304 @@ class PithosClient(TestCase):
         expected['permissions'] = expected.pop('sharing')
         self.assertEqual(put.mock_calls[-1], call(obj, **expected))
 
+    @patch('%s.get_object_hashmap' % pithos_pkg, return_value=dict(
+        block_hash='sha256', block_size=4, bytes=14,
+        hashes=['h0', 'h1', 'h2', 'h3']))
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_coalesced(self, GET, GOH):
+        data = 'b0b1b2b3b4b5b6'
+        GET.side_effect = self._fake_object_get(data)
+        for max_blocks, exp_ranges in (
+                (1, ['0-3', '4-7', '8-11', '12-13']),
+                (3, ['0-11', '12-13']),
+                (8, ['0-13'])):
+            self.client.MAX_RANGE_BLOCKS = max_blocks
+            GET.reset_mock()
+            self.assertEqual(self.client.download_to_string(obj), data)
+            self.assertEqual(sorted([
+                c[2]['data_range'] for c in GET.mock_calls]), sorted([
+                    'bytes=%s' % r for r in exp_ranges]))
+
+            GET.reset_mock()
+            with NamedTemporaryFile() as f:
+                self.client.download_object(obj, f)
+                f.seek(0)
+                self.assertEqual(f.read(), data)
+            self.assertEqual(sorted([
+                c[2]['async_headers']['Range'] for c in GET.mock_calls]),
+                sorted(['bytes=%s' % r for r in exp_ranges]))
+
+        GET.reset_mock()
+        self.assertEqual(
+            self.client.download_to_string(obj, range_str='2-9'), data[2:10])
+        self.assertEqual(sorted([
+            c[2]['data_range'] for c in GET.mock_calls]), [
+                'bytes=2-3', 'bytes=4-7', 'bytes=8-9'])
+
+    @patch('%s.get_container_info' % pithos_pkg, return_value=dict(
+        container_info, **{'x-container-block-size': 4}))
+    @patch('%s.download_object' % pithos_pkg)
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_objects(self, GET, download, GCI):
+        order = []
+
+        def get(obj, **kwargs):
+            order.append(obj)
+            r = FR()
+            r.content = 'small %s' % obj
+            r.headers = {'content-length': '%s' % len(r.content)}
+            r.status_code = 200 if obj != 'o2' else 304
+            return r
+
+        def download_object(obj, f, **kwargs):
+            order.append(obj)
+            f.write('large %s' % obj)
+
+        GET.side_effect, download.side_effect = get, download_object
+        tmp_dir = mkdtemp()
+        try:
+            targets = [
+                ('o0', '%s/f0' % tmp_dir, 9), ('o1', '%s/f1' % tmp_dir, 3),
+                ('o2', '%s/f2' % tmp_dir, 2), ('o3', '%s/f3' % tmp_dir, None)]
+            r = list(self.client.download_objects(targets, max_files=1))
+            self.assertEqual(order, ['o2', 'o1', 'o0', 'o3'])
+            self.assertEqual(r, [(o, l) for o, l, s in [
+                targets[2], targets[1], targets[0], targets[3]]])
+            for obj, lpath, exp in (
+                    ('o0', 'f0', 'large o0'), ('o1', 'f1', 'small o1'),
+                    ('o2', 'f2', ''), ('o3', 'f3', 'large o3')):
+                self.assertEqual(open('%s/%s' % (tmp_dir, lpath)).read(), exp)
+            self.assertEqual(GET.mock_calls[-1][2]['stream'], True)
+
+            del order[:]
+            download.reset_mock()
+            r = list(self.client.download_objects(
+                targets, max_files=3, small_files=False, version='v1'))
+            self.assertEqual(sorted(order), ['o0', 'o1', 'o2', 'o3'])
+            self.assertTrue(all([
+                c[2]['version'] == 'v1' for c in download.mock_calls]))
+
+            #  A truncated small object is not accepted
+            truncated = FR()
+            truncated.content = 'small'
+            truncated.headers = {'content-length': '8'}
+            GET.side_effect = lambda obj, **kwargs: truncated
+            self.assertRaises(ClientError, list, self.client.download_objects(
+                targets[1:2], max_files=1))
+
+            #  A failure is raised when the other downloads are finished
+            flying = []
+
+            def slow_download(obj, f, **kwargs):
+                if obj == 'o0':
+                    raise ClientError('failed', 500)
+                flying.append(obj)
+                sleep(0.1)
+                flying.remove(obj)
+
+            download.side_effect = slow_download
+            self.assertRaises(ClientError, list, self.client.download_objects(
+                targets, max_files=4, small_files=False))
+            self.assertEqual(flying, [])
+        finally:
+            rmtree(tmp_dir)
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test__dump_block(self, GET):
+        data, headers = 'b0b1b2b3b4', dict()
+
+        def get(obj, **kwargs):
+            r = FR()
+            r.content, r.headers = data, headers
+            return r
+
+        GET.side_effect = get
+        with NamedTemporaryFile() as f:
+            fd = f.fileno()
+            self.client._dump_block(fd, 4, [[0], [4, 12], [8]], obj)
+            self.assertEqual(GET.mock_calls[-1], call(obj, stream=True))
+            f.seek(0)
+            self.assertEqual(f.read(), data + '\x00\x00' + data[4:8])
+            self.assertRaises(
+                ClientError, self.client._dump_block, fd, 4, [[0], [4]], obj)
+            self.assertRaises(
+                ClientError, self.client._dump_block, fd, 4, [[0]] * 5, obj)
+
+            #  A truncated body is detected by its length
+            data = 'b0'
+            self.assertRaises(
+                ClientError, self.client._dump_block, fd, 4, [[0]], obj,
+                async_headers=dict(Range='bytes=0-3'))
+            self.client._dump_block(
+                fd, 4, [[0]], obj, async_headers=dict(Range='bytes=0-1'))
+            data, headers = 'b0b1b2b3b4', {'content-length': '12'}
+            self.assertRaises(
+                ClientError, self.client._dump_block,
+                fd, 4, [[0], [4], [8]], obj)
+
+    @patch('%s.get_object_hashmap' % pithos_pkg, return_value=dict(
+        block_hash='sha256', block_size=4, bytes=14,
+        hashes=['h0', 'h1', 'h2', 'h3']))
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_to_buffer(self, GET, GOH):
+        data = 'b0b1b2b3b4b5b6'
+        GET.side_effect = self._fake_object_get(data)
+        for max_blocks in (1, 3):
+            self.client.MAX_RANGE_BLOCKS = max_blocks
+            r = self.client.download_to_buffer(obj)
+            self.assertTrue(isinstance(r, bytearray))
+            self.assertEqual(str(r), data)
+            for range_str, exp in (
+                    ('2-9', data[2:10]), ('-3', data[-3:]),
+                    ('1-2,5-13', data[1:3] + data[5:])):
+                self.assertEqual(str(self.client.download_to_buffer(
+                    obj, range_str=range_str)), exp)
+                self.assertEqual(self.client.download_to_string(
+                    obj, range_str=range_str), exp)
+        buf = bytearray('-' * 20)
+        r = self.client.download_to_buffer(obj, buffer_=memoryview(buf))
+        self.assertEqual(str(buf), data + '-' * 6)
+        self.assertRaises(
+            ClientError, self.client.download_to_buffer, obj,
+            buffer_=bytearray(10))
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_object_delta(self, GET):
+        data = 'BBBBAAAAXXXXAAAAXXXXEE'
+        GET.side_effect = self._fake_object_get(data)
+        with NamedTemporaryFile() as f:
+            f.write('AAAABBBBXXXXCCCCZZZZ\x00\x00ZZ')
+            self.client.download_object(obj, f, delta=True)
+            f.seek(0)
+            self.assertEqual(f.read(), data)
+        self.assertEqual([c[2]['async_headers']['Range'] for c in (
+            GET.mock_calls) if not c[2].get('hashmap')], ['bytes=20-21'])
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_object_resume(self, GET):
+        data = ''.join(['%s%s' % (i, i) for i in range(10)] + ['\x00\x00'])
+        GET.side_effect = self._fake_object_get(data)
+        for threads in (1, 3):
+            self.client.HASH_THREADS = threads
+            GET.reset_mock()
+            with NamedTemporaryFile() as f:
+                f.write(data[:4] + 'XXXX' + data[8:12] + '\x00' + data[13:18])
+                f.flush()
+                self.client.download_object(obj, f, resume=True)
+                f.seek(0)
+                self.assertEqual(f.read(), data)
+            self.assertEqual(sorted([
+                c[2]['async_headers']['Range'] for c in (
+                    GET.mock_calls) if not c[2].get('hashmap')]), [
+                        'bytes=12-15', 'bytes=16-19', 'bytes=4-7'])
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_object_failure(self, GET):
+        from threading import Lock
+        data, lock, flying = 'aaaabbbbccccdddd', Lock(), []
+        fake_get = self._fake_object_get(data)
+
+        def get(obj, async_headers={}, **kwargs):
+            if 'Range' in async_headers:
+                if async_headers['Range'].startswith('bytes=0-'):
+                    raise ClientError('Internal Server Error', 500)
+                with lock:
+                    flying.append(1)
+                sleep(0.1)
+                with lock:
+                    flying.pop()
+            return fake_get(obj, async_headers=async_headers, **kwargs)
+
+        GET.side_effect = get
+        self.client.MAX_THREADS = 4
+        self.client.concurrency_policy = pithos.ConcurrencyPolicy()
+        with NamedTemporaryFile() as f:
+            self.assertRaises(
+                ClientError, self.client.download_object, obj, f)
+            #  No block is still being written when the error is raised
+            self.assertEqual(flying, [])
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_object_sparse(self, GET):
+        data = 'abcd' + '\x00' * 8 + 'efgh' + '\x00' * 4 + 'ij'
+        GET.side_effect = self._fake_object_get(data)
+        for local, resume, exp in (
+                ('', False, ['bytes=0-3', 'bytes=12-15', 'bytes=20-21']),
+                ('abcdXXXXXX', True, ['bytes=12-15', 'bytes=20-21'])):
+            GET.reset_mock()
+            with NamedTemporaryFile() as f:
+                f.write(local)
+                f.flush()
+                self.client.download_object(obj, f, resume=resume)
+                f.seek(0)
+                self.assertEqual(f.read(), data)
+            self.assertEqual(sorted([
+                c[2]['async_headers']['Range'] for c in (
+                    GET.mock_calls) if not c[2].get('hashmap')]), exp)
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_stream_down(self, GET):
+        from StringIO import StringIO
+        from threading import Lock
+        data = ''.join(['%s%s' % (i, i) for i in range(20)] + ['ab'])
+        hashes = [pithos._pithos_hash(
+            data[i:i + 4], 'sha256') for i in range(0, len(data), 4)]
+        lock, flying, peak = Lock(), [], [0]
+
+        def get(obj, data_range=None, **kwargs):
+            with lock:
+                flying.append(1)
+                self.assertTrue(len(flying) <= 3)
+                peak[0] = max(peak[0], len(flying))
+            sleep(0.01 * randint(1, 2))
+            r = FR()
+            r.content = ''.join([data[int(s):int(e) + 1] for s, e in [
+                rng.split('-') for rng in data_range[6:].split(',')]])
+            with lock:
+                flying.pop()
+            return r
+
+        GET.side_effect = get
+        hashmap = dict(
+            block_hash='sha256', block_size=4, bytes=len(data),
+            hashes=hashes)
+        for buffer_blocks, max_range, range_str, exp, parallel in (
+                (1, 1, None, data, False),
+                (3, 1, None, data, True),
+                (3, 2, None, data, False),
+                (3, 3, '5-17,-3', data[5:18] + data[-3:], True)):
+            self.client.MAX_RANGE_BLOCKS = max_range
+            dst, peak[0] = StringIO(), 0
+            self.client.stream_down(
+                obj, dst, buffer_blocks=buffer_blocks, hashmap=hashmap,
+                range_str=range_str)
+            self.assertEqual(dst.getvalue(), exp)
+            #  Blocks are fetched in parallel, even with MAX_THREADS = 1
+            self.assertEqual(peak[0] > 1, parallel)
+
+    @patch('%s.object_get' % pithos_pkg)
+    def test_download_block_store(self, GET):
+        from kamaki.clients.pithos.cache import BlockStore
+        data = 'b0b1b2b3b0b1b2'
+        GET.side_effect = self._fake_object_get(data)
+        store_dir = mkdtemp()
+        try:
+            self.client.block_store = BlockStore(store_dir)
+            self.assertEqual(self.client.download_to_string(obj), data)
+            self.assertEqual(len(listdir(store_dir)), 3)
+
+            GET.reset_mock()
+            self.assertEqual(self.client.download_to_string(obj), data)
+            with NamedTemporaryFile() as f:
+                self.client.download_object(obj, f)
+                f.seek(0)
+                self.assertEqual(f.read(), data)
+            self.assertEqual(len([
+                c for c in GET.mock_calls if not c[2].get('hashmap')]), 0)
+        finally:
+            self.client.block_store = None
+            rmtree(store_dir)
+
     @patch('%s.get_object_hashmap' % pithos_pkg, return_value=object_hashmap)
     @patch('%s.object_get' % pithos_pkg, return_value=FR())
     def test_download_to_string(self, GET, GOH):
@@ -1319,8 +2206,20 @@ class PithosClient(TestCase):
                 v or kwargs.get(k))
 
     @patch('%s.get_object_hashmap' % pithos_pkg, return_value=object_hashmap)
-    @patch('%s.object_get' % pithos_pkg, return_value=FR())
+    @patch('%s.object_get' % pithos_pkg)
     def test_download_object(self, GET, GOH):
+
+        def get(obj, async_headers={}, **kwargs):
+            r = FR()
+            r.chunk_size = 64 * 1024
+            if 'Range' in async_headers:
+                start, end = async_headers['Range'][6:].split('-')
+                start, size = int(start), int(end) - int(start) + 1
+                start %= len(FR.content)
+                r.content = FR.content[start:start + size]
+            return r
+
+        GET.side_effect = get
         num_of_blocks = 8
         tmpFile = self._create_temp_file(num_of_blocks)
         FR.content = tmpFile.read(4 * 1024 * 1024)
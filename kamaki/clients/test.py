@@ -31,7 +31,7 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.
 
-from mock import patch, call
+from mock import patch, call, Mock
 from unittest import makeSuite, TestSuite, TextTestRunner, TestCase
 from time import sleep
 from inspect import getmembers, isclass
@@ -49,7 +49,8 @@ from kamaki.clients.cyclades.test import (
 from kamaki.clients.image.test import ImageClient
 from kamaki.clients.storage.test import StorageClient
 from kamaki.clients.pithos.test import (
-    PithosClient, PithosRestClient, PithosMethods)
+    PithosClient, PithosRestClient, PithosMethods, HashCache, BlockStore,
+    UploadJournal)
 from kamaki.clients.blockstorage.test import (
     BlockStorageRestClient, BlockStorageClient)
 
@@ -137,6 +138,44 @@ class RequestManager(TestCase):
         request.assert_called_once_with(**expected)
         getresponse.assert_called_once_with()
 
+    def test_perform_file_slice(self):
+        from httplib import HTTPConnection, BadStatusLine
+        from tempfile import TemporaryFile
+        from objpool.http import _patch_connection
+        from kamaki.clients.utils import FileSlice
+        sent = []
+
+        class FakeSocket(object):
+
+            def sendall(self, data):
+                sent.append(data)
+
+            def close(self):
+                pass
+
+        conn = HTTPConnection('example.com')
+        conn.connect = lambda: setattr(conn, 'sock', FakeSocket())
+        #  Pooled connections re-send a request on an empty status line
+        _patch_connection(conn)
+        response = object()
+        conn._old_getresponse = Mock(
+            side_effect=[BadStatusLine("''"), response])
+        with TemporaryFile() as f:
+            f.write('some file data')
+            f.flush()
+            fslice = FileSlice(f, 5, 4)
+            fslice.CHUNK_SIZE = 3
+            r = self.RM(
+                'PUT', 'http://example.com', '/',
+                data=fslice, headers={'Content-Length': '4'}).perform(conn)
+        self.assertTrue(r is response)
+        self.assertEqual(len(conn._old_getresponse.mock_calls), 2)
+        requests = [i for i, data in enumerate(sent) if (
+            data.startswith('PUT /'))]
+        self.assertEqual(len(requests), 2)
+        for start, end in zip(requests, requests[1:] + [len(sent)]):
+            self.assertEqual(''.join(sent[start + 1:end]), 'file')
+
 
 class FakeResp(object):
 
@@ -153,6 +192,20 @@ class FakeResp(object):
         return self.HEADERS.items()
 
 
+class FakeStreamResp(FakeResp):
+
+    def __init__(self):
+        self.unread = self.READ
+
+    def read(self, amt=None):
+        amt = len(self.unread) if amt is None else amt
+        data, self.unread = self.unread[:amt], self.unread[amt:]
+        return data
+
+    def isclosed(self):
+        return not self.unread
+
+
 class ResponseManager(TestCase):
 
     def setUp(self):
@@ -214,6 +267,47 @@ class ResponseManager(TestCase):
         self.assertEqual(self.RM.headers, FakeResp.HEADERS)
         assert perform.call_count == 1
 
+    @patch('httplib.HTTPConnection.close')
+    @patch('kamaki.clients.RequestManager.perform')
+    def test_dirty_connection(self, perform, close):
+        from kamaki.clients import ResponseManager, RequestManager
+        perform.return_value = FakeResp()
+        self.assertEqual(self.RM.content, FakeResp.READ)
+        self.assertFalse(close.called)
+
+        perform.return_value.read = Mock(side_effect=IOError('Reset'))
+        rm = ResponseManager(RequestManager('GET', 'http://ok', '/'))
+        self.assertRaises(IOError, rm._get_response)
+        close.assert_called_once_with()
+
+    @patch('httplib.HTTPConnection.close')
+    @patch('kamaki.clients.RequestManager.perform')
+    def test_stream(self, perform, close):
+        from kamaki.clients import ResponseManager, RequestManager
+        for read, exp_content, exp_close in (
+                (lambda rm: ''.join(rm.iter_content(4)), FakeResp.READ, 0),
+                (lambda rm: rm.content, FakeResp.READ, 0),
+                (lambda rm: rm.read(5), FakeResp.READ[:5], 1)):
+            perform.return_value = FakeStreamResp()
+            rm = ResponseManager(RequestManager('GET', 'http://ok', '/'))
+            rm.stream = True
+            self.assertEqual(rm.status_code, FakeResp.status)
+            self.assertEqual(perform.return_value.unread, FakeResp.READ)
+            self.assertEqual(read(rm), exp_content)
+            rm.close()
+            self.assertEqual(close.call_count, exp_close)
+            self.assertEqual(rm.read(), '')
+            close.reset_mock()
+
+        perform.return_value = FakeStreamResp()
+        rm = ResponseManager(RequestManager('GET', 'http://ok', '/'))
+        rm.stream, buf = True, bytearray('-' * 20)
+        self.assertEqual(rm.readinto(memoryview(buf)[2:7]), 5)
+        self.assertEqual(str(buf), '--%s' % FakeResp.READ[:5] + '-' * 13)
+        self.assertEqual(rm.readinto(buf), len(FakeResp.READ) - 5)
+        self.assertEqual(buf[:len(FakeResp.READ) - 5], FakeResp.READ[5:])
+        self.assertFalse(close.called)
+
 
 class SilentEvent(TestCase):
 
@@ -269,6 +363,203 @@ class SilentEvent(TestCase):
                 self.assertFalse(t.exception)
 
 
+class Future(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import Future
+        self.F = Future
+
+    def test_run(self):
+        f = self.F(lambda x, y=0: x + y, 40, y=2)
+        self.assertTrue(f.isAlive())
+        self.assertFalse(f.done())
+        f.run()
+        self.assertFalse(f.isAlive())
+        self.assertEqual(f.value, 42)
+        self.assertFalse(f.exception)
+        self.assertEqual(f.result(), 42)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('some error')
+        f = self.F(fail)
+        f.run()
+        self.assertTrue(isinstance(f.exception, ValueError))
+        self.assertRaises(ValueError, f.result)
+
+    def test_cancel(self):
+        from kamaki.clients import ClientError
+        f = self.F(self.fail)
+        f.cancel()
+        self.assertTrue(f.done())
+        self.assertRaises(ClientError, f.result)
+        f.run()
+        self.assertRaises(ClientError, f.result)
+        f = self.F(lambda: 42)
+        f.run()
+        f.cancel()
+        self.assertEqual(f.result(), 42)
+
+    def test_add_done_callback(self):
+        finished = []
+        f = self.F(lambda: 42)
+        f.add_done_callback(finished.append)
+        self.assertEqual(finished, [])
+        f.run()
+        self.assertEqual(finished, [f])
+        f.add_done_callback(finished.append)
+        self.assertEqual(finished, [f, f])
+
+
+class WorkerPool(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import WorkerPool
+        self.pool = WorkerPool(3)
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_resize(self):
+        for faulty in (-1, 0, 0.5, 'a string'):
+            self.assertRaises(AssertionError, self.pool.resize, faulty)
+        self.pool.resize(5)
+        self.assertEqual(self.pool.size, 5)
+
+    def test_submit(self):
+        futures = [self.pool.submit(lambda x: 2 * x, i) for i in range(20)]
+        self.assertEqual([f.result() for f in futures], range(0, 40, 2))
+        self.assertTrue(len(self.pool._workers) <= 3)
+
+    def test_concurrency(self):
+        from threading import Lock, Event
+        lock, running, peak, full = Lock(), [0], [0], Event()
+
+        def job():
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+                if running[0] == 3:
+                    full.set()
+            #  The first jobs wait until the pool is full
+            full.wait(5)
+            with lock:
+                running[0] -= 1
+
+        futures = [self.pool.submit(job) for i in range(9)]
+        for f in futures:
+            f.result()
+        self.assertEqual(peak[0], 3)
+
+    def test_idle_timeout(self):
+        from kamaki.clients import WorkerPool
+        pool = WorkerPool(4)
+        pool.IDLE_TIMEOUT = 0.1
+        futures = [pool.submit(sleep, 0.01) for i in range(8)]
+        workers = list(pool._workers)
+        self.assertEqual(len(workers), 4)
+        for f in futures:
+            f.result()
+        for i in range(50):
+            if not pool._workers:
+                break
+            sleep(0.05)
+        self.assertEqual(pool._workers, [])
+        for worker in workers:
+            worker.join(1.0)
+            self.assertFalse(worker.is_alive())
+        self.assertEqual(pool.submit(lambda: 42).result(), 42)
+
+    def test_exception(self):
+        def fail():
+            raise ValueError('some error')
+        f = self.pool.submit(fail)
+        self.assertRaises(ValueError, f.result)
+        self.assertEqual(self.pool.submit(lambda: 42).result(), 42)
+
+    def test_shutdown(self):
+        from kamaki.clients import ClientError
+        from threading import Event
+        go = Event()
+        running = self.pool.submit(go.wait, 5)
+        pending = [self.pool.submit(go.wait, 5) for i in range(6)]
+        sleep(0.1)
+        go.set()
+        self.pool.shutdown()
+        self.assertTrue(running.result())
+        self.assertEqual(self.pool._workers, [])
+        self.assertTrue(self.pool.closed)
+        self.assertRaises(AssertionError, self.pool.submit, go.wait)
+        for f in pending:
+            self.assertTrue(f.done())
+            if f.exception:
+                self.assertTrue(isinstance(f.exception, ClientError))
+
+
+class AIMDConcurrency(TestCase):
+
+    def setUp(self):
+        from kamaki.clients import AIMDConcurrency
+        self.now = [1000.0]
+        self.time = patch(
+            'kamaki.clients.time', side_effect=lambda: self.now[0])
+        self.time.start()
+        self.policy = AIMDConcurrency()
+
+    def tearDown(self):
+        self.time.stop()
+
+    def _round(self, size=1000, elapsed=0.1, err=None, wait=0.01):
+        """Feed the policy with a round of (limit) finished futures, which
+        take wait seconds (of a fake clock) in total"""
+        from kamaki.clients import Future
+        self.now[0] += wait
+        for i in range(self.policy.limit):
+            f = Future(None)
+            f.size, f.started, f.finished = size, 1.0, 1.0 + elapsed
+            if err:
+                f._exception = err
+            self.policy.update(f)
+
+    def test_reset(self):
+        self.policy.reset(8)
+        self.assertEqual((self.policy.limit, self.policy.max_limit), (1, 8))
+        self.policy.limit = 6
+        self.policy.reset(4)
+        self.assertEqual(self.policy.limit, 4)
+
+    def test_increase(self):
+        self.policy.reset(10)
+        for exp in (2, 4, 8, 10, 10):
+            self._round()
+            self.assertEqual(self.policy.limit, exp)
+        self.policy.slow_start, self.policy._throughput = False, None
+        self.policy.limit = 5
+        self._round()
+        self.assertEqual(self.policy.limit, 6)
+
+    def test_decrease(self):
+        from kamaki.clients import ClientError
+        self.policy.reset(10)
+        self.policy.limit = 8
+        self._round(err=ClientError('overloaded', 503))
+        self.assertEqual(self.policy.limit, 4)
+        self.assertFalse(self.policy.slow_start)
+        self._round(err=ClientError('not found', 404))
+        self.assertEqual(self.policy.limit, 4)
+
+        #  throughput drops, latency stable
+        self._round(wait=0.01, elapsed=0.1)
+        self.assertEqual(self.policy.limit, 5)
+        self._round(wait=0.2, elapsed=0.1)
+        self.assertEqual(self.policy.limit, 4)
+
+        #  throughput drops, latency grows
+        self._round(wait=0.01, elapsed=0.1)
+        self._round(wait=0.2, elapsed=0.5)
+        self.assertEqual(self.policy.limit, 2)
+
+
 class FR(object):
     json = None
     text = None
@@ -291,7 +582,7 @@ class Client(TestCase):
     def setUp(self):
         from kamaki.clients import Client
         from kamaki.clients import ClientError as CE
-        self.endpoint_url = 'http://example.com'
+        self.endpoint_url = 'http://example.com/v1.0'
         self.token = 's0m370k3n=='
         self.client = Client(self.endpoint_url, self.token)
         self.CE = CE
@@ -354,6 +645,58 @@ class Client(TestCase):
                 self.client._watch_thread_limit(list())
                 self.assertEqual(exp_limit, self.client._thread_limit)
 
+    def test__sliding_window(self):
+        from kamaki.clients import Future, ConcurrencyPolicy
+        from threading import Lock
+        lock, running, peak, prepared = Lock(), [0], [0], []
+
+        def job(i):
+            with lock:
+                running[0] += 1
+                peak[0] = max(peak[0], running[0])
+            sleep(0.02 + 0.01 * (i % 3))
+            with lock:
+                running[0] -= 1
+            return i
+
+        def futures():
+            for i in range(12):
+                prepared.append(i)
+                yield Future(job, i)
+
+        self.client.concurrency_policy = ConcurrencyPolicy()
+        for limit in (1, 3, 4):
+            prepared, peak[0] = [], 0
+            self.client.MAX_THREADS = limit
+            done = []
+            for future in self.client._sliding_window(futures()):
+                self.assertFalse(future.isAlive())
+                self.assertTrue(len(prepared) - len(done) <= limit)
+                done.append(future.result())
+            self.assertEqual(sorted(done), range(12))
+            self.assertEqual(peak[0], limit)
+
+        #  When the caller stops early, no job is left running
+        prepared = []
+        for future in self.client._sliding_window(futures()):
+            break
+        self.assertEqual(running[0], 0)
+        self.assertEqual(len(prepared), 4)
+        self.client.shutdown_workers()
+
+    def test_async_run(self):
+        self.client.MAX_THREADS = 3
+        r = self.client.async_run(
+            lambda x, y: x * y, [dict(x=i, y=2) for i in range(10)])
+        self.assertEqual(r, range(0, 20, 2))
+
+        def fail(x):
+            raise ValueError('failed %s' % x)
+
+        self.assertRaises(
+            ValueError, self.client.async_run, fail, [dict(x=1), dict(x=2)])
+        self.client.shutdown_workers()
+
     @patch('kamaki.clients.Client.set_header')
     def test_set_header(self, SH):
         for name, value, condition in product(
@@ -401,6 +744,22 @@ class Client(TestCase):
                 RespInit.mock_calls[-1],
                 call(FR, connection_retry_limit=0, poolsize=None))
 
+    @patch('kamaki.clients.RequestManager.perform')
+    def test_request_stream_error(self, perform):
+        from kamaki.clients.utils import https
+        perform.return_value = FakeStreamResp()
+        with patch.object(
+                https.PooledHTTPConnection, 'release', autospec=True,
+                side_effect=https.PooledHTTPConnection.release) as release:
+            try:
+                self.client.request('get', '/path', stream=True)
+                self.assertTrue(False, 'ClientError not raised')
+            except self.CE as ce:
+                self.assertEqual(ce.status, FakeResp.status)
+                self.assertTrue(FakeResp.READ in '%s' % ce)
+        self.assertEqual(perform.return_value.unread, '')
+        self.assertEqual(len(release.mock_calls), 1)
+
     @patch('kamaki.clients.Client.request', return_value='lala')
     def _test_foo(self, foo, request):
         method = getattr(self.client, foo)
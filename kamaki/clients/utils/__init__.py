@@ -31,7 +31,11 @@
 # interpreted as representing official policies, either expressed
 # or implied, of GRNET S.A.
 
+import os
 import unicodedata
+from threading import Lock
+
+_io_lock = Lock()
 
 
 def _matches(val1, val2, exactMath=True):
@@ -97,18 +101,100 @@ def path4url(*args):
 def readall(openfile, size, retries=7):
     """Read a file until size is reached"""
     remains = size if size > 0 else 0
-    buf = ''
+    chunks = []
     for i in range(retries):
         tmp_buf = openfile.read(remains)
         if tmp_buf:
-            buf += tmp_buf
+            chunks.append(tmp_buf)
             remains -= len(tmp_buf)
             if remains > 0:
                 continue
-        return buf
+        return chunks[0] if len(chunks) == 1 else ''.join(chunks)
     raise IOError('Failed to read %s bytes from file' % size)
 
 
+def pwrite(fd, data, offset):
+    """Write data at an offset of a file descriptor, from any thread
+    os.pwrite is used if available, otherwise lseek and write are locked
+    """
+    data = memoryview(data)
+    if hasattr(os, 'pwrite'):
+        while data:
+            written = os.pwrite(fd, data, offset)
+            data, offset = data[written:], offset + written
+        return
+    with _io_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        while data:
+            data = data[os.write(fd, data):]
+
+
+def pread(fd, size, offset):
+    """Read up to size bytes from an offset of a file descriptor, from any
+    thread, without conflicting with pwrite
+    """
+    if hasattr(os, 'pread'):
+        return os.pread(fd, size, offset)
+    with _io_lock:
+        os.lseek(fd, offset, os.SEEK_SET)
+        return os.read(fd, size)
+
+
+class FileSlice(object):
+    """A part of a file, to be used as the body of an http request. It is
+    read from the file one chunk at a time, while the request is sent, so
+    that it is never loaded in memory as a whole. httplib sends it through
+    read(), which starts over when the slice is exhausted, so that the same
+    body can be sent again if the request is retried
+    """
+
+    CHUNK_SIZE = 64 * 1024
+
+    def __init__(self, fileobj, offset=0, size=None):
+        """
+        :param fileobj: (file) an open regular file
+
+        :param offset: (int) where the slice starts
+
+        :param size: (int) the size of the slice, up to the end of the file
+            (and by default, all the way to it)
+        """
+        self.fd, self.offset = fileobj.fileno(), offset
+        remains = max(0, os.fstat(self.fd).st_size - offset)
+        self.size = remains if size is None else min(size, remains)
+        self._position = 0
+
+    def __len__(self):
+        return self.size
+
+    def read(self, size=None):
+        """:returns: (str) the next chunk of up to size (by default,
+            CHUNK_SIZE) bytes, or '' at the end of the slice, after which
+            the next read starts over from the start of the slice
+        """
+        size = min(size or self.CHUNK_SIZE, self.size - self._position)
+        if size <= 0:
+            self._position = 0
+            return ''
+        chunk = pread(self.fd, size, self.offset + self._position)
+        if not chunk:
+            self._position = 0
+            raise IOError('Failed to read %s bytes from file' % self.size)
+        self._position += len(chunk)
+        return chunk
+
+    def __iter__(self):
+        """:returns: (generator) of the chunks of the slice, from its start
+        """
+        offset, end = self.offset, self.offset + self.size
+        while offset < end:
+            chunk = pread(self.fd, min(self.CHUNK_SIZE, end - offset), offset)
+            if not chunk:
+                raise IOError('Failed to read %s bytes from file' % self.size)
+            offset += len(chunk)
+            yield chunk
+
+
 def escape_ctrl_chars(s):
     """Escape control characters from unicode and string objects."""
     if isinstance(s, unicode):
@@ -36,6 +36,8 @@ import httplib
 import socket
 import ssl
 import os.path
+from threading import Lock
+from time import time
 from objpool import http
 
 log = logging.getLogger(__name__)
@@ -49,6 +51,36 @@ class SSLCredentialsMissing(ssl.SSLError):
     """Missing credentials for SSL authentication"""
 
 
+_contexts, _contexts_lock = dict(), Lock()
+
+
+def _get_context(ca_file, ignore_ssl, key_file=None, cert_file=None):
+    """:returns: (ssl.SSLContext) shared by all connections with the same SSL
+        settings, so that certificates are loaded once, or None if the ssl
+        module does not support contexts (Python < 2.7.9)
+    """
+    if not hasattr(ssl, 'SSLContext'):
+        return None
+    key = (ca_file, ignore_ssl, key_file, cert_file)
+    with _contexts_lock:
+        context = _contexts.get(key)
+        if context is None:
+            context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+            context.options |= ssl.OP_NO_SSLv2 | ssl.OP_NO_SSLv3
+            if ignore_ssl:
+                context.verify_mode = ssl.CERT_NONE
+            else:
+                context.verify_mode = ssl.CERT_REQUIRED
+                #  As with ssl.wrap_socket, no CA is trusted unless ca_file
+                #  is set (the system CA store is not loaded)
+                if ca_file:
+                    context.load_verify_locations(ca_file)
+            if cert_file:
+                context.load_cert_chain(cert_file, key_file)
+            _contexts[key] = context
+    return context
+
+
 class HTTPSClientAuthConnection(httplib.HTTPSConnection):
     """HTTPS connection, with full client-based SSL Authentication support"""
 
@@ -77,6 +109,9 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
         This is needed to pass cert_reqs=ssl.CERT_REQUIRED as parameter to
         ssl.wrap_socket(), which forces SSL to check server certificate against
         our client certificate.
+
+        Where supported, connections share an SSL context per SSL settings,
+        instead of loading the certificate files for every new connection.
         """
         source_address = getattr(self, 'source_address', None)
         socket_args = [(self.host, self.port), self.timeout] + (
@@ -87,7 +122,15 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
             self._tunnel()
 
         try:
-            if self.ignore_ssl:
+            context = _get_context(
+                self.ca_file, self.ignore_ssl, self.key_file, self.cert_file)
+            started = time()
+            if context:
+                self.sock = context.wrap_socket(
+                    sock, server_hostname=(
+                        self._tunnel_host or self.host) if (
+                            ssl.HAS_SNI) else None)
+            elif self.ignore_ssl:
                 self.sock = ssl.wrap_socket(
                     sock, self.key_file, self.cert_file,
                     cert_reqs=ssl.CERT_NONE)
@@ -95,6 +138,9 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
                 self.sock = ssl.wrap_socket(
                     sock, self.key_file, self.cert_file,
                     ca_certs=self.ca_file, cert_reqs=ssl.CERT_REQUIRED)
+            stats = getattr(self, 'pool_stats', None)
+            if stats:
+                stats.count('handshakes', handshake_time=time() - started)
         except UnicodeError as ue:
             raise SSLUnicodeError(0, SSLUnicodeError.__doc__, ue)
         except IOError as ioe:
@@ -115,7 +161,132 @@ class HTTPSClientAuthConnection(httplib.HTTPSConnection):
 
 
 http.HTTPConnectionPool._scheme_to_class['https'] = HTTPSClientAuthConnection
-PooledHTTPConnection = http.PooledHTTPConnection
+
+
+class PoolStats(object):
+    """Usage statistics of the connection pool of a (scheme, netloc)
+
+    requests: connections checked out of the pool
+    reused: checked out connections which were already connected
+    connections: checked out connections which had to connect (again)
+    handshakes: SSL handshakes, which took handshake_time seconds in total
+    evicted: idle connections dropped, because the server closed them
+    discarded: connections closed when returned to the pool, because they
+        were not reusable (e.g., unread response, or too many uses)
+    """
+
+    KEYS = (
+        'requests', 'reused', 'connections', 'handshakes', 'handshake_time',
+        'evicted', 'discarded')
+
+    def __init__(self):
+        self._lock = Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            for key in self.KEYS:
+                setattr(self, key, 0)
+
+    def count(self, key, **more):
+        """Increase key by one, and each key of more by its value"""
+        with self._lock:
+            setattr(self, key, getattr(self, key) + 1)
+            for k, v in more.items():
+                setattr(self, k, getattr(self, k) + v)
+
+    @property
+    def reuse_rate(self):
+        """:returns: (float) the fraction of requests on reused connections"""
+        return float(self.reused) / self.requests if self.requests else 0.0
+
+    def as_dict(self):
+        with self._lock:
+            stats = dict([(key, getattr(self, key)) for key in self.KEYS])
+        stats['reuse_rate'] = self.reuse_rate
+        return stats
+
+
+class HTTPConnectionPool(http.HTTPConnectionPool):
+    """An objpool HTTP connection pool, which keeps PoolStats"""
+
+    def __init__(self, *args, **kwargs):
+        super(HTTPConnectionPool, self).__init__(*args, **kwargs)
+        self.stats = PoolStats()
+
+    def _pool_create(self):
+        conn = super(HTTPConnectionPool, self)._pool_create()
+        conn.pool_stats = self.stats
+        return conn
+
+    def _pool_verify(self, conn):
+        verified = super(HTTPConnectionPool, self)._pool_verify(conn)
+        if conn is not None and not verified:
+            self.stats.count('evicted')
+            conn.close()
+        return verified
+
+    def _pool_cleanup(self, conn):
+        discarded = super(HTTPConnectionPool, self)._pool_cleanup(conn)
+        if discarded:
+            self.stats.count('discarded')
+        return discarded
+
+    def pool_get(self, *args, **kwargs):
+        conn = super(HTTPConnectionPool, self).pool_get(*args, **kwargs)
+        if conn is not None:
+            self.stats.count('requests', **{
+                'connections' if conn.sock is None else 'reused': 1})
+        return conn
+
+
+_pools, _pools_lock = dict(), Lock()
+
+
+class PooledHTTPConnection(http.PooledHTTPConnection):
+    """Same as objpool.http.PooledHTTPConnection, but the connections come
+    from pools which keep statistics (see pool_stats)"""
+
+    _pool_class = HTTPConnectionPool
+
+    def get_pool(self):
+        kwargs = self._pool_kwargs
+        pool = kwargs.pop('pool', None)
+        if pool is not None:
+            return pool
+        scheme, netloc = kwargs['scheme'], kwargs['netloc']
+        key = (kwargs.get('pool_key', self._pool_key), scheme, netloc)
+        with _pools_lock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = HTTPConnectionPool(scheme, netloc, size=kwargs.get(
+                    'size', http.default_pool_size))
+                _pools[key] = pool
+        return pool
+
+
+def pool_stats(reset=False):
+    """:returns: (dict) {'scheme://netloc': PoolStats.as_dict()} for every
+        connection pool
+
+    :param reset: (bool) start counting from zero again, after reading
+    """
+    stats = dict()
+    with _pools_lock:
+        pools = _pools.values()
+    for pool in pools:
+        totals = stats.setdefault(
+            '%s://%s' % (pool.scheme, pool.netloc),
+            dict.fromkeys(PoolStats.KEYS, 0))
+        pool_stats = pool.stats.as_dict()
+        for key in PoolStats.KEYS:
+            totals[key] += pool_stats[key]
+        if reset:
+            pool.stats.reset()
+    for totals in stats.values():
+        totals['reuse_rate'] = float(totals['reused']) / (
+            totals['requests'] or 1)
+    return stats
 
 
 def patch_with_certs(ca_file):
@@ -34,6 +34,7 @@
 from unittest import TestCase
 from tempfile import TemporaryFile
 from itertools import product
+from mock import patch
 
 from kamaki.clients import utils
 
@@ -140,6 +141,103 @@ class Utils(TestCase):
             self.assertEqual(utils.readall(f, 1), '')
             self.assertRaises(IOError, utils.readall, f, 1, 0)
 
+    def test_FileSlice(self):
+        tstr = '1234567890'
+        with TemporaryFile() as f:
+            f.write(tstr)
+            f.flush()
+            for args, expected in (
+                    ((), tstr), ((3, ), tstr[3:]), ((3, 4), tstr[3:7]),
+                    ((8, 5), tstr[8:]), ((12, ), '')):
+                fslice = utils.FileSlice(f, *args)
+                self.assertEqual(len(fslice), len(expected))
+                fslice.CHUNK_SIZE = 3
+                self.assertTrue(all([len(c) <= 3 for c in fslice]))
+                self.assertEqual(''.join(fslice), expected)
+                self.assertEqual(''.join(fslice), expected)
+            fslice = utils.FileSlice(f, 3, 4)
+            fslice.CHUNK_SIZE = 3
+            for i in range(2):
+                self.assertEqual(fslice.read(), '456')
+                self.assertEqual(fslice.read(2), '7')
+                self.assertEqual(fslice.read(), '')
+            fslice = utils.FileSlice(f, 2)
+            f.truncate(5)
+            self.assertRaises(IOError, ''.join, fslice)
+
+    def test_pool_stats(self):
+        from threading import Thread
+        from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+        from SocketServer import ThreadingMixIn
+        from kamaki.clients import Client
+        from kamaki.clients.utils import https
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.send_response(200)
+                self.send_header('Content-Length', '2')
+                self.end_headers()
+                self.wfile.write('ok')
+
+            def log_message(self, *args):
+                pass
+
+        class Server(ThreadingMixIn, HTTPServer):
+            daemon_threads = True
+
+        server = Server(('127.0.0.1', 0), Handler)
+        thread = Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            url = 'http://127.0.0.1:%s' % server.server_port
+            https.pool_stats(reset=True)
+            client = Client('%s/v1' % url, 'token')
+            for i in range(3):
+                self.assertEqual(client.get('/').content, 'ok')
+            stats = https.pool_stats()[url]
+            self.assertEqual(stats['requests'], 3)
+            self.assertEqual(stats['connections'], 1)
+            self.assertEqual(stats['reused'], 2)
+            self.assertEqual(stats['handshakes'], 0)
+            self.assertEqual(stats['reuse_rate'], 2.0 / 3)
+            self.assertEqual(https.pool_stats(reset=True)[url]['reused'], 2)
+            self.assertEqual(https.pool_stats()[url]['requests'], 0)
+        finally:
+            server.shutdown()
+            server.server_close()
+
+    def test__get_context(self):
+        import ssl
+        from kamaki.clients.utils import https
+        context = https._get_context(None, True)
+        if context is None:
+            #  The ssl module does not support contexts
+            return
+        self.assertTrue(context is https._get_context(None, True))
+        self.assertEqual(context.verify_mode, ssl.CERT_NONE)
+        with patch('ssl.SSLContext.load_verify_locations') as LVL:
+            context = https._get_context('/some/ca/file', False)
+            self.assertTrue(
+                context is https._get_context('/some/ca/file', False))
+        LVL.assert_called_once_with('/some/ca/file')
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+
+        with patch('ssl.SSLContext.load_default_certs') as LDC:
+            context = https._get_context(None, False)
+        self.assertEqual(LDC.mock_calls, [])
+        self.assertEqual(context.verify_mode, ssl.CERT_REQUIRED)
+        self.assertEqual(context.cert_store_stats()['x509_ca'], 0)
+
+        conn = https.HTTPSClientAuthConnection(
+            'example.com', ca_file='/no/such/ca/file')
+        with patch('socket.create_connection'):
+            self.assertRaises(https.SSLCredentialsMissing, conn.connect)
+        self.assertFalse(('/no/such/ca/file', False, None, None) in (
+            https._contexts))
+
     def test_escape_ctrl_chars(self):
         gr_synnefo = u'\u03c3\u03cd\u03bd\u03bd\u03b5\u03c6\u03bf'
         gr_kamaki = u'\u03ba\u03b1\u03bc\u03ac\u03ba\u03b9'